@@ -0,0 +1,181 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import rotate
+import deskew
+
+# The workers must never open a window and wait for a key
+rotate.debug = False
+
+image_extensions = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+def findImages(inputs):
+    """
+    Finds the images of the given directories and glob patterns.
+    :param inputs: a list of directories, file paths or glob patterns
+    :return: the sorted list of the image paths, without duplicates
+    """
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        for path in glob.glob(pattern):
+            if os.path.isfile(path) and path.lower().endswith(image_extensions):
+                paths.add(os.path.normpath(path))
+
+    return sorted(paths)
+
+def outputPath(path, output_dir):
+    """
+    Gets the path of the rotated image of the given image.
+    :param path: the path of the image
+    :param output_dir: the directory of the rotated images
+    :return: the path of the rotated image
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output_dir, name + "_rotated.jpg")
+
+def isUpToDate(path, output_path, previous=None, method="hough"):
+    """
+    Checks if the rotated image exists, is newer than the image and was made by the same deskew method.
+    :param path: the path of the image
+    :param output_path: the path of the rotated image
+    :param previous: the result of the image in the report of the previous run, None if it has none
+    :param method: the deskew method of this run
+    :return: True if the image does not need to be processed again
+    """
+    if previous is None or previous.get("requested_method") != method or previous.get("status") == "failed":
+        return False
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(path)
+
+def processImage(path, output_path, method="hough"):
+    """
+    Runs the rotation correction of rotate.py on one image and writes the rotated image.
+    :param path: the path of the image
+    :param output_path: the path of the rotated image
+    :param method: the deskew estimator of deskew.py, or "auto" for the cheapest one that is confident enough
+    :return: a dictionary with the file, the requested method, the angles, the estimators, the time
+    and the status of the image
+    """
+    result = {"file": path, "output": output_path, "requested_method": method, "method": None, "dft_angle": None,
+              "angle": None, "confidence": None, "estimates": [], "seconds": 0.0, "status": "rotated"}
+    start = time.perf_counter()
+    try:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError("could not read the image")
+
+        connected, _ = rotate.preprocessImage(image)
+        if method == "auto":
+            estimate, tried = deskew.autoEstimate(connected)
+        else:
+            estimate = deskew.estimateSkew(connected, method)
+            tried = [estimate]
+        result["estimates"] = tried
+        if estimate["angle"] is None:
+            raise ValueError(estimate["error"])
+
+        rotated_image = rotate.rotateImage(image, estimate["angle"])
+        if not cv2.imwrite(output_path, rotated_image):
+            raise ValueError("could not write the rotated image")
+
+        result["method"] = estimate["method"]
+        result["dft_angle"] = estimate.get("dft_angle")
+        result["angle"] = estimate["angle"]
+        result["confidence"] = estimate["confidence"]
+    except Exception as error:
+        result["status"] = "failed"
+        result["error"] = f"{type(error).__name__}: {error}"
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def loadReport(report_path):
+    """
+    Loads the results of a previous run, so the skipped images keep their angles in the report.
+    :param report_path: the path of the report
+    :return: a dictionary with the result of every image path
+    """
+    try:
+        with open(report_path) as file:
+            return {result["file"]: result for result in json.load(file)["files"]}
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return {}
+
+def saveReport(report_path, results):
+    """
+    Writes the report as JSON, through a temporary file so an interrupted run keeps the old report.
+    :param report_path: the path of the report
+    :param results: the list with the result of every image
+    """
+    summary = {status: sum(result["status"] == status for result in results)
+               for status in ("rotated", "skipped", "failed")}
+    temporary_path = report_path + ".tmp"
+    with open(temporary_path, "w") as file:
+        json.dump({"summary": summary, "files": results}, file, indent=2)
+    os.replace(temporary_path, report_path)
+
+def batchRotate(inputs, output_dir="rotated", report_path=None, workers=None, force=False, chunk_size=4,
+                method="hough"):
+    """
+    Corrects the rotation of every image of the inputs on a pool of processes.
+    :param inputs: a list of directories, file paths or glob patterns
+    :param output_dir: the directory of the rotated images
+    :param report_path: the path of the JSON report, by default rotation_report.json in output_dir
+    :param workers: the number of processes, by default the number of cores
+    :param force: if True, also process the images whose rotated image is up to date, an image is out of date
+    if its rotated image is older, or the report has no result of the same method for it
+    :param chunk_size: the number of images sent to a process at once
+    :param method: the deskew estimator of deskew.py, or "auto" for the cheapest one that is confident enough
+    :return: the list with the result of every image
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = report_path or os.path.join(output_dir, "rotation_report.json")
+    previous = loadReport(report_path)
+
+    paths = findImages(inputs)
+    output_paths = [outputPath(path, output_dir) for path in paths]
+    if len(set(output_paths)) != len(output_paths):
+        raise ValueError("Some images have the same name, their rotated images would overwrite each other")
+
+    results = {}
+    pending = []
+    for path, output_path in zip(paths, output_paths):
+        if not force and isUpToDate(path, output_path, previous.get(path), method):
+            results[path] = dict(previous[path], status="skipped")
+        else:
+            pending.append((path, output_path))
+
+    if pending:
+        # OpenCV has its own threads, one per process is enough when every core runs a worker
+        with ProcessPoolExecutor(workers, initializer=cv2.setNumThreads, initargs=(1,)) as pool:
+            for result in pool.map(partial(processImage, method=method), *zip(*pending), chunksize=chunk_size):
+                results[result["file"]] = result
+                print(result["status"], result["file"], result["angle"])
+
+    results = [results[path] for path in paths]
+    saveReport(report_path, results)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correct the rotation of many scanned pages at once")
+    parser.add_argument("inputs", nargs="+", help="directories, image paths or glob patterns")
+    parser.add_argument("-o", "--output-dir", default="rotated", help="the directory of the rotated images")
+    parser.add_argument("-r", "--report", default=None, help="the path of the JSON report")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="the number of processes")
+    parser.add_argument("-f", "--force", action="store_true", help="also process the up to date images")
+    parser.add_argument("-m", "--method", choices=list(deskew.estimators) + ["auto"], default="hough",
+                        help="the deskew estimator, auto picks the cheapest one that is confident enough")
+    args = parser.parse_args()
+
+    batch_results = batchRotate(args.inputs, args.output_dir, args.report, args.workers, args.force,
+                                method=args.method)
+    sys.exit(1 if any(result["status"] == "failed" for result in batch_results) else 0)
@@ -0,0 +1,163 @@
+import io
+import time
+import contextlib
+from functools import partial
+import numpy as np
+import cv2
+import rotate
+
+def houghEstimator(input_image, search="full"):
+    """
+    The rotation correction of rotate.py: the DFT and Hough lines angle refined by serialSearch.
+    The confidence is scored like in projectionEstimator, how much the projection profile of the found angle
+    stands out of the median profile, so the two estimators can be compared.
+    :param input_image: the connected image of preprocessImage
+    :param search: the mode of serialSearch
+    :return: a dictionary with the angle for rotateImage, the confidence and the DFT angle
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        dft_angle = rotate.findRotationAngle(input_image, cv2.cvtColor(input_image, cv2.COLOR_GRAY2BGR))
+        serial_angle = rotate.serialSearch(input_image, dft_angle, search)
+
+    confidence = profileConfidence(input_image, float(serial_angle))
+    return {"angle": float(serial_angle), "confidence": confidence, "dft_angle": float(dft_angle)}
+
+def profileScores(xs, ys, weights, angles, num_bins, chunk_size=1 << 22):
+    """
+    Scores many angles in one pass: the pixels are projected on the rows of the image rotated by each angle,
+    and the score of an angle is the sum of the squared row sums, which is largest when the text lines
+    are horizontal.
+    :param xs, ys: the coordinates of the pixels, relative to the center of the image
+    :param weights: the value of each pixel
+    :param angles: the angles of rotation in degrees, like in rotateImage
+    :param num_bins: the number of rows of the projection, at least the diagonal of the image
+    :param chunk_size: the maximum number of projected pixels held in memory at a time
+    :return: the score of every angle
+    """
+    radians = np.radians(np.asarray(angles, dtype=np.float64))
+    scores = np.empty(len(radians))
+    step = max(1, chunk_size // max(len(xs), 1))
+
+    for start in range(0, len(radians), step):
+        chunk = radians[start:start + step]
+
+        # The row of pixel (x, y) after rotateImage, with the angle counterclockwise
+        rows = -np.sin(chunk)[:, np.newaxis] * xs + np.cos(chunk)[:, np.newaxis] * ys
+        bins = (np.floor(rows).astype(np.int64) + num_bins // 2) + np.arange(len(chunk))[:, np.newaxis] * num_bins
+        profiles = np.bincount(bins.ravel(), np.tile(weights, len(chunk)), len(chunk) * num_bins)
+        scores[start:start + step] = np.sum(profiles.reshape(len(chunk), num_bins) ** 2, axis=1)
+
+    return scores
+
+def profilePixels(input_image, size=512):
+    """
+    Gets the pixels of the text of a downsampled image, for profileScores.
+    :param input_image: a binary image of the text
+    :param size: the size of the longest side of the downsampled image
+    :return: the coordinates of the pixels relative to the center, their values and the number of bins,
+    or None for an empty image
+    """
+    height, width = input_image.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    small = cv2.resize(input_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    ys, xs = np.nonzero(small)
+    if len(xs) == 0:
+        return None
+    weights = small[ys, xs].astype(np.float64)
+    num_bins = int(np.hypot(*small.shape[:2])) + 2
+
+    return xs - small.shape[1] / 2, ys - small.shape[0] / 2, weights, num_bins
+
+def profileConfidence(input_image, angle, max_angle=45, step=1.0, size=512):
+    """
+    Scores the angle of any estimator on the scale of projectionEstimator, 1 minus the ratio of the median
+    score of the angles from -max_angle to max_angle to the score of the angle, clipped to [0, 1].
+    :param input_image: the connected image of preprocessImage, or any binary image of the text
+    :param angle: the angle for rotateImage
+    :param max_angle, step, size: the parameters of projectionEstimator
+    :return: the confidence
+    """
+    pixels = profilePixels(input_image, size)
+    if pixels is None:
+        return 0.0
+
+    scores = profileScores(*pixels[:3], np.arange(-max_angle, max_angle + step / 2, step), pixels[3])
+    score = profileScores(*pixels[:3], [angle], pixels[3])[0]
+    return float(np.clip(1 - np.median(scores) / score, 0, 1)) if score > 0 else 0.0
+
+def projectionEstimator(input_image, max_angle=45, step=1.0, fine_step=0.1, size=512):
+    """
+    Finds the angle whose rotation gives the sharpest horizontal projection profile, on a downsampled image.
+    All the angles from -max_angle to max_angle are scored in one pass, then the best one is refined.
+    The confidence is how much the best score stands out of the median score, from 0 for a flat
+    score curve to 1.
+    :param input_image: the connected image of preprocessImage, or any binary image of the text
+    :param max_angle: the largest angle in degrees
+    :param step: the step of the angles in degrees
+    :param fine_step: the step of the refinement around the best angle
+    :param size: the size of the longest side of the downsampled image
+    :return: a dictionary with the angle for rotateImage and the confidence
+    """
+    pixels = profilePixels(input_image, size)
+    if pixels is None:
+        return {"angle": 0.0, "confidence": 0.0}
+    xs, ys, weights, num_bins = pixels
+
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    scores = profileScores(xs, ys, weights, angles, num_bins)
+    best_angle = angles[np.argmax(scores)]
+
+    fine_angles = np.arange(best_angle - step, best_angle + step + fine_step / 2, fine_step)
+    fine_scores = profileScores(xs, ys, weights, fine_angles, num_bins)
+
+    confidence = 1 - np.median(scores) / np.max(scores)
+    # Adding 0 turns a -0.0 angle into 0.0
+    angle = float(np.round(fine_angles[np.argmax(fine_scores)], 6)) + 0.0
+    return {"angle": angle, "confidence": float(confidence)}
+
+# The deskew estimators, from the cheapest to the most expensive. Each one takes the connected image
+# of preprocessImage and returns a dictionary with at least the angle for rotateImage and a confidence in [0, 1]
+estimators = {
+    "projection": projectionEstimator,
+    "hough-coarse": partial(houghEstimator, search="coarse"),
+    "hough": houghEstimator,
+}
+
+def estimateSkew(input_image, method="hough"):
+    """
+    Runs one deskew estimator and times it.
+    :param input_image: the connected image of preprocessImage
+    :param method: the name of the estimator in estimators
+    :return: the dictionary of the estimator with its method and seconds, an estimator that fails
+    gets no angle and a confidence of 0
+    """
+    if method not in estimators:
+        raise ValueError(f"Unknown deskew method: {method}")
+
+    start = time.perf_counter()
+    try:
+        estimate = estimators[method](input_image)
+    except Exception as error:
+        estimate = {"angle": None, "confidence": 0.0, "error": f"{type(error).__name__}: {error}"}
+    estimate["method"] = method
+    estimate["seconds"] = time.perf_counter() - start
+
+    return estimate
+
+def autoEstimate(input_image, methods=("projection", "hough"), min_confidence=0.3):
+    """
+    Runs the estimators in order until one is confident enough, so the cheap ones are used when they are reliable.
+    :param input_image: the connected image of preprocessImage
+    :param methods: the names of the estimators, from the cheapest
+    :param min_confidence: the confidence that is enough to stop
+    :return: the chosen estimate, the first confident one or else the most confident one,
+    and the list with all the estimates that were run
+    """
+    tried = []
+    for method in methods:
+        tried.append(estimateSkew(input_image, method))
+        if tried[-1]["angle"] is not None and tried[-1]["confidence"] >= min_confidence:
+            return tried[-1], tried
+
+    return max(tried, key=lambda estimate: estimate["confidence"]), tried
@@ -1,12 +1,28 @@
 import cv2
 import os
+import time
 import numpy as np
 from scipy.signal import find_peaks
-from sklearn.neighbors import KNeighborsClassifier
 from sklearn.model_selection import train_test_split
+from glyphs import glyphBatch
+from glyphmodel import fitGlyphModel, saveFittedModel, glyphModelMatches, loadGlyphModel, classifyGlyphs
 
 debug = True
 
+# The trained classifier, it is trained again if retrain is True or the file is missing, unreadable
+# or trained with another reduction
+model_path = "glyph_model.bin"
+retrain = False
+
+# The reduction of the glyph features: None for the raw pixels, "pca" or "projection",
+# report compares them all before training
+reduction = None
+reduction_dimension = 32
+report = False
+
+# The float epsilon of the Otsu threshold of OpenCV
+float_epsilon = float(np.finfo(np.float32).eps)
+
 
 def display(input_image, frame_name="OpenCV Image"):
     if not debug:
@@ -19,21 +35,85 @@ def display(input_image, frame_name="OpenCV Image"):
     cv2.waitKey(0)
 
 
-def preprocessImage(input_image):
+def toGray(input_image):
+    """
+    Converts a BGR image to grayscale, so a page is converted only once
+    :param input_image: the given image, BGR or already grayscale
+    :return: the grayscale image, the given image itself if it is already grayscale
+    """
+    if input_image.ndim == 2:
+        return input_image
+    return cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+
+def otsuThreshold(histogram):
+    """
+    Finds the Otsu threshold of a 256 bin histogram, with the same steps as cv2.THRESH_OTSU on a uint8 image,
+    so the histogram can be accumulated over parts of the image.
+    :param histogram: the pixel count of every value from 0 to 255
+    :return: the threshold, the pixels above it are foreground
+    """
+    histogram = [int(count) for count in histogram]
+    scale = 1.0 / sum(histogram)
+    mu = 0.0
+    for i, count in enumerate(histogram):
+        mu += i * float(count)
+    mu *= scale
+
+    # The between-class variance of every split, the first split with the largest one wins
+    mu1, q1 = 0.0, 0.0
+    max_sigma, max_val = 0.0, 0.0
+    for i, count in enumerate(histogram):
+        p_i = count * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < float_epsilon or max(q1, q2) > 1.0 - float_epsilon:
+            continue
+
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_val = i
+
+    return max_val
+
+def gradientImage(input_image):
+    """
+    Finds the morphological gradient of the image, the edges of the text.
+    :param input_image: the grayscale image
+    :return: the gradient map, each pixel depends on its 3x3 neighbourhood
+    """
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    return cv2.morphologyEx(input_image, cv2.MORPH_GRADIENT, kernel)
+
+def binarize(input_image, thresh=None):
+    """
+    Binarizes the image with a fixed threshold, or with the Otsu threshold of the image itself.
+    :param input_image: the grayscale image
+    :param thresh: the threshold, None for Otsu
+    :return: the binary image with values 0 and 255
+    """
+    if thresh is None:
+        return cv2.threshold(input_image, 0.0, 255.0, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return cv2.threshold(input_image, thresh, 255.0, cv2.THRESH_BINARY)[1]
+
+def preprocessImage(input_image, thresh=None):
     """
     Preprocess the image to get the text regions
-    :param input_image: the given image
+    :param input_image: the given image, BGR or grayscale
+    :param thresh: the threshold of the gradient map, None for the Otsu threshold of this image
     :return: connected_image the image with connected text regions
     bw_image: the binarized image
     """
-    grayscale = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+    grayscale = toGray(input_image)
 
     # find the gradient map
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-    grad = cv2.morphologyEx(grayscale, cv2.MORPH_GRADIENT, kernel)
+    grad = gradientImage(grayscale)
 
     # Binarize the gradient image
-    _, bw_image = cv2.threshold(grad, 0.0, 255.0, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    bw_image = binarize(grad, thresh)
     bw_inverted_image = cv2.bitwise_not(bw_image)
 
     # connect horizontally oriented regions
@@ -45,14 +125,15 @@ def preprocessImage(input_image):
 
     return inverted_image, bw_inverted_image
 
-def preprocessText(input_image):
+def preprocessText(input_image, thresh=None):
     """
     Preprocess the image to make it easier to find the text
-    :param input_image: the given image
+    :param input_image: the given image, BGR or grayscale
+    :param thresh: the threshold of the grayscale image, None for the Otsu threshold of this image
     :return: the preprocessed image
     """
-    grayscale = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
-    binary_image = cv2.threshold(grayscale, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    grayscale = toGray(input_image)
+    binary_image = binarize(grayscale, thresh)
 
     # define the kernel and invert the image
     kernel = np.ones((3, 3), np.uint8)
@@ -72,41 +153,60 @@ def preprocessText(input_image):
 
     return final_image
 
-def detectLines(input_image, display_img):
-    current_directory = os.getcwd()
-    final_directory = os.path.join(current_directory, r'lines')
-    if not os.path.exists(final_directory):
-        os.makedirs(final_directory)
-
-    display_img = cv2.cvtColor(display_img, cv2.COLOR_BGR2GRAY)
-
-    # Compute and smooth the vertical projection of brightness
-    vertical_projection = cv2.reduce(input_image, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F)
+def linePeaks(vertical_projection):
+    """
+    Finds the lines of the page in its vertical projection.
+    :param vertical_projection: the (height, 1) float32 sums of the rows of the connected image
+    :return: the rows of the peaks, the boundaries of the lines
+    """
+    # Smooth the vertical projection of brightness
     vertical_projection = cv2.GaussianBlur(vertical_projection, (3, 3), 0)
     row_sum = np.sum(vertical_projection, axis=1)
 
     # Find the peaks in the vertical projection
     peaks, _ = find_peaks(row_sum, height=900000, distance=20, width=10)
+    return peaks
+
+def saveLine(line, save_dir, i):
+    """
+    Saves the image of a line without its margins and its white rows.
+    :param line: the rows of the line of the grayscale page
+    :param save_dir: the directory to save the line image in
+    :param i: the number of the line
+    """
+    line = line[:, 5:line.shape[1]-5]
+    # Find the rows that contain only white pixels and remove them from the image
+    white_rows = np.all(line >= 245, axis=1)
+    cropped_image = line[~white_rows, :]
+
+    cv2.imwrite(os.path.join(save_dir, f"line{i}.png"), cropped_image)
+
+def detectLines(input_image, display_img, save_dir=None):
+    # The line images are only cropped when they are saved
+    if save_dir is not None:
+        display_img = toGray(display_img)
+        os.makedirs(save_dir, exist_ok=True)
+
+    # Compute the vertical projection of brightness and find its peaks
+    vertical_projection = cv2.reduce(input_image, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F)
+    peaks = linePeaks(vertical_projection)
     coordinates = {}
 
     # Draw the detected lines on the original image
     for i, peak in enumerate(peaks):
         coordinates[i] = peak
 
-        if i == 0:
+        if i == 0 or save_dir is None:
             continue
         else:
-            line = display_img[coordinates[i-1]:peak, 5:display_img.shape[1]-5]
-            # Find the rows that contain only white pixels and remove them from the image
-            white_rows = np.all(line >= 245, axis=1)
-            cropped_image = line[~white_rows, :]
-
-            # cv2.imwrite(f"lines/line{i}.png", cropped_image)
+            saveLine(display_img[coordinates[i-1]:peak], save_dir, i)
 
     return coordinates
 
-def detectWords(input_coordinates, input_image, display_img):
-    display_img = cv2.cvtColor(display_img, cv2.COLOR_BGR2GRAY)
+def detectWords(input_coordinates, input_image, display_img, save_dir=None):
+    display_img = toGray(display_img)
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
     coords = []
 
     for i in range(len(input_coordinates)):
@@ -136,76 +236,119 @@ def detectWords(input_coordinates, input_image, display_img):
             else:
                 word = line[0:line.shape[0], coordinates[j-1]:peak]
 
-            # Save the line image to a file (x,y)
-            # cv2.imwrite(f"words/line{i}_word{j + 1}.png", word)
+            # Save the word image to a file (x,y)
+            if save_dir is not None:
+                cv2.imwrite(os.path.join(save_dir, f"line{i}_word{j + 1}.png"), word)
 
         coords.append(coordinates)
 
     return coords
 
-def detectLetters(input_coordinates, input_image, display_img):
-    current_directory = os.getcwd()
-    final_directory = os.path.join(current_directory, r'letters')
-    if not os.path.exists(final_directory):
-        os.makedirs(final_directory)
+def whiteRuns(white_columns):
+    """
+    Finds the runs of white columns that are followed by a non-white column, a run at the end of the line
+    is not a letter boundary. Runs that touch each other are merged.
+    :param white_columns: a boolean array, True for the white columns
+    :return: the (K,) arrays with the first and the last column of each run
+    """
+    # +1 where a run starts and -1 after it ends, the end of the line closes no run
+    edges = np.diff(np.concatenate(([False], white_columns, [True])).view(np.int8))
+    ends = np.flatnonzero(edges == -1) - 1
+    starts = np.flatnonzero(edges == 1)[:len(ends)]
+    if len(starts) == 0:
+        return starts, ends
+
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = starts[1:] > ends[:-1] + 1
+    return starts[keep], ends[np.append(keep[1:], True)]
+
+def letterBoxes(white_columns, height, letter_width=40):
+    """
+    Splits a line into letters at the runs of white columns. Every letter spans from the end of a run to the
+    start of the next one, and the last letter takes letter_width columns after the last run.
+    :param white_columns: a boolean array, True for the white columns of the line
+    :param height: the height of the line
+    :param letter_width: the width of the last letter
+    :return: a (K, 4) array with the letters [x1, y1, x2, y2], relative to the line
+    """
+    starts, ends = whiteRuns(white_columns)
+    if len(starts) == 0 or (len(starts) == 1 and starts[0] == 0):
+        return np.empty((0, 4), dtype=np.intp)
+
+    # The run at the start of the line is the margin, it is not a letter boundary
+    if starts[0] == 0:
+        lefts, rights = ends[:-1], starts[1:]
+    else:
+        lefts, rights = np.append(0, ends[:-1]), starts
+
+    boxes = np.zeros((len(rights) + 1, 4), dtype=np.intp)
+    boxes[:-1, 0] = lefts
+    boxes[:-1, 2] = rights
+    boxes[-1, 0] = starts[-1]
+    boxes[-1, 2] = starts[-1] + letter_width
+    boxes[:, 3] = height
+
+    return boxes
+
+def splitLetters(line, save_dir=None, i=0):
+    """
+    Finds the letters of one line, between margins of 5 columns.
+    :param line: the rows of the line of the preprocessed grayscale image with dark letters
+    :param save_dir: the directory to save the letter images in, None to save nothing
+    :param i: the number of the line, for the names of the letter images
+    :return: a (K, 4) array with the letters [x1, y1, x2, y2], relative to the line without its left margin
+    """
+    cropped_image = line[:, 5:line.shape[1]-5]
+    # white_rows = np.all(line >= 245, axis=1)
+    # cropped_image = line[~white_rows, :]
+
+    # Find the white columns, the ones without any pixel darker than 240
+    white_columns = cv2.reduce(cropped_image, 0, cv2.REDUCE_MIN)[0] >= 240
 
-    display_img = cv2.cvtColor(display_img, cv2.COLOR_BGR2GRAY)
-    coords = []
+    # Extract the letters, all the letters of the line at once
+    lcoordinates = letterBoxes(white_columns, cropped_image.shape[0])
+
+    if save_dir is not None:
+        for j, (lx1, ly1, lx2, ly2) in enumerate(lcoordinates):
+            cv2.imwrite(os.path.join(save_dir, f"line{i}_letter{j + 1}.png"), cropped_image[ly1:ly2, lx1:lx2])
+
+    return lcoordinates
+
+def lineLetters(input_coordinates, input_image, page=False, save_dir=None):
+    """
+    Finds the letters of every line, one line at a time.
+    :param input_coordinates: the coordinates of the lines of detectLines
+    :param input_image: the preprocessed grayscale image with dark letters
+    :param page: False for boxes relative to each line, True for boxes in page coordinates
+    :param save_dir: the directory to save the letter images in, None to save nothing
+    :return: a generator of (line number, (K, 4) letters [x1, y1, x2, y2])
+    """
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
 
     for i in range(len(input_coordinates)):
         if i == 0:
             continue
         # Calculate the coordinates of each line
-        x1, y1, x2, y2 = 5, input_coordinates[i-1], display_img.shape[1]-5, input_coordinates[i]
-        cropped_image = input_image[y1:y2, x1:x2]
-        # white_rows = np.all(line >= 245, axis=1)
-        # cropped_image = line[~white_rows, :]
-
-        # Convert the image to binary format and find the white columns
-        binary_image = np.where(cropped_image >= 240, 1, 0)
-        white_columns = np.all(binary_image == 1, axis=0)
-
-        # Identify the letter boundaries
-        boundaries = []
-        start_index = None
-        for k, is_white in enumerate(white_columns):
-            if is_white and start_index is None:
-                start_index = k
-            elif not is_white and start_index is not None:
-                end_index = k - 1
-                if len(boundaries) == 0 or start_index > boundaries[-1][1] + 1:
-                    boundaries.append((start_index, end_index))
-                else:
-                    boundaries[-1] = (boundaries[-1][0], end_index)
-                start_index = None
-
-        # Extract the letters
-        letters = []
-        lcoordinates = []
-        for start, end in boundaries:
-            if start == 0:
-                temp_end = end
-                continue
-
-            letter = cropped_image[0:cropped_image.shape[0], temp_end:start]
-            lcoords = (temp_end, 0, start, cropped_image.shape[0])
-            lcoordinates.append(lcoords)
-            letters.append(letter)
-
-            if start == boundaries[-1][0]:
-                letter = cropped_image[0:cropped_image.shape[0], start:start + 40]
-                lcoords = (start, 0, start+40, cropped_image.shape[0])
-                lcoordinates.append(lcoords)
-                letters.append(letter)
-
-            temp_end = end
-
-        # for j, letter in enumerate(letters):
-        #     cv2.imwrite(f"letters/line{i}_letter{j + 1}.png", letter)
-
-        coords.append(lcoordinates)
+        x1, y1, y2 = 5, input_coordinates[i-1], input_coordinates[i]
+        lcoordinates = splitLetters(input_image[y1:y2], save_dir, i)
 
-    return coords
+        if page:
+            lcoordinates += [x1, y1, x1, y1]
+
+        yield i, lcoordinates
+
+def detectLetters(input_coordinates, input_image, display_img=None, page=False, save_dir=None):
+    """
+    Finds the letters of all the lines.
+    :param input_coordinates: the coordinates of the lines of detectLines
+    :param input_image: the preprocessed grayscale image with dark letters
+    :param display_img: unused, the lines span the width of input_image
+    :param page: False for boxes relative to each line, True for boxes in page coordinates
+    :param save_dir: the directory to save the letter images in, None to save nothing
+    :return: the list with the (K, 4) letters [x1, y1, x2, y2] of every line
+    """
+    return [lcoordinates for _, lcoordinates in lineLetters(input_coordinates, input_image, page, save_dir)]
 
 def returnCharacters(filepath):
     chars = []
@@ -219,49 +362,107 @@ def returnCharacters(filepath):
     return chars
 
 
-if __name__ == "__main__":
-    image = cv2.imread("text1_v2.png")
-    display_image = np.copy(image)
-    connected, thresh = preprocessImage(image)
+def loadTrainingSet(image_path, text_path):
+    """
+    Extracts the letters of a page and pairs them with the characters of its text.
+    :param image_path: the path of the page image
+    :param text_path: the path of the text of the page
+    :return: the (N, 1024) glyphs and the N characters
+    """
+    # Convert the page to grayscale once, every step below works on it
+    grayscale = toGray(cv2.imread(image_path))
+    connected, thresh = preprocessImage(grayscale)
 
-    lines_coordinates = detectLines(connected, display_image)
-    # words_coordinates = detectWords(lines_coordinates, thresh, display_image)
+    lines_coordinates = detectLines(connected, grayscale)
+    # words_coordinates = detectWords(lines_coordinates, thresh, grayscale)
 
-    processed_image = preprocessText(display_image)
+    processed_image = preprocessText(grayscale)
     pro_invert = cv2.bitwise_not(processed_image)
-    letter_coordinates = detectLetters(lines_coordinates, pro_invert, display_image)
+    # The glyphs are cut from the whole page, so the boxes must be in page coordinates
+    letter_coordinates = detectLetters(lines_coordinates, pro_invert, page=True)
+
+    characters = returnCharacters(text_path)
 
-    file_path = 'text1_v2.txt'
-    characters = returnCharacters(file_path)
-    y = characters
-    X = []
+    # Resize all the letters into one (N, 1024) matrix
+    X = glyphBatch(pro_invert, letter_coordinates, workers=os.cpu_count())
 
-    for line in letter_coordinates:
-        for letter in line:
-            x1, y1, x2, y2 = letter
-            temp = pro_invert[y1:y2, x1:x2]
-            resized = cv2.resize(temp, (32, 32), interpolation=cv2.INTER_CUBIC)
-            X.append(resized.flatten())
+    return X, characters
+
+def trainModel(image_path, text_path, path=None, k=3, method=None, dimension=32):
+    """
+    Trains the KNN classifier on the letters of a page and its text, and saves the training glyphs,
+    their labels and the feature reduction as the glyph model.
+    :param image_path: the path of the page image
+    :param text_path: the path of the text of the page
+    :param path: the path of the glyph model, by default model_path
+    :param k: the number of neighbours
+    :param method: the reduction of the features, None for the raw pixels, "pca" or "projection"
+    :param dimension: the number of components of PCA
+    :return: the accuracy on the test split
+    """
+    X, y = loadTrainingSet(image_path, text_path)
 
     # Split the dataset
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
 
-    # Train the KNN model
-    k = 3
-    knn = KNeighborsClassifier(n_neighbors=k)
-    knn.fit(X_train, y_train)
+    # Train the KNN model, the reduction is fitted on the training glyphs only
+    model = fitGlyphModel(X_train, y_train, k, method, dimension)
 
     # Make predictions
-    y_pred = knn.predict(X_test)
+    y_pred = classifyGlyphs(model, X_test)
 
     # Evaluate the accuracy of the classifier
-    accuracy = knn.score(X_test, y_test)
-    print(f"Accuracy: {accuracy}")
+    accuracy = np.mean(y_pred == np.asarray(y_test))
+
+    saveFittedModel(path or model_path, model)
+
+    return accuracy
+
+def reductionReport(image_path, text_path, options=((None, 0), ("pca", 16), ("pca", 32), ("pca", 64),
+                                                     ("projection", 0)), k=3):
+    """
+    Compares the feature reductions on the same train and test split, to pick the operating point.
+    :param image_path: the path of the page image
+    :param text_path: the path of the text of the page
+    :param options: the (method, dimension) pairs to compare
+    :param k: the number of neighbours
+    :return: a list with the method, the dimension, the accuracy and the predictions per second of every option
+    """
+    X, y = loadTrainingSet(image_path, text_path)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42)
+
+    results = []
+    for method, dimension in options:
+        model = fitGlyphModel(X_train, y_train, k, method, dimension)
+
+        start = time.perf_counter()
+        y_pred = classifyGlyphs(model, X_test)
+        seconds = time.perf_counter() - start
+
+        results.append({"method": method or "pixels", "dimension": model["dimension"],
+                        "accuracy": float(np.mean(y_pred == np.asarray(y_test))),
+                        "predictions_per_second": len(X_test) / max(seconds, 1e-9)})
+        print(f"{results[-1]['method']:>10} {model['dimension']:>5}  accuracy {results[-1]['accuracy']:.3f}  "
+              f"{results[-1]['predictions_per_second']:.0f} predictions/s")
+
+    return results
+
+
+if __name__ == "__main__":
+    if report:
+        reductionReport("text1_v2.png", 'text1_v2.txt')
+
+    if retrain or not glyphModelMatches(model_path, reduction, reduction_dimension):
+        accuracy = trainModel("text1_v2.png", 'text1_v2.txt', method=reduction, dimension=reduction_dimension)
+        print(f"Accuracy: {accuracy}")
+
+    # Loading the model only maps the file, no training is needed to classify
+    model = loadGlyphModel(model_path)
 
     test_letter = cv2.imread('dataset/j.png')
     processed_image = preprocessText(test_letter)
     pro_invert = cv2.bitwise_not(processed_image)
     test_letter = cv2.resize(pro_invert, (32, 32), interpolation=cv2.INTER_CUBIC)
 
-    prediction = knn.predict(test_letter.reshape(-1, 1024))
+    prediction = classifyGlyphs(model, test_letter.reshape(-1, 1024))
     print(f"Prediction: {prediction}")
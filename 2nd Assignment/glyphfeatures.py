@@ -0,0 +1,68 @@
+import numpy as np
+
+# The reductions of the glyph features, their index is the code stored in the glyph model file
+reduction_methods = [None, "pca", "projection"]
+
+def projectionFeatures(glyphs, zones=4):
+    """
+    Computes compact shape features of square glyphs: the mean of every row, the mean of every column
+    and the mean of every cell of a zones x zones grid.
+    :param glyphs: an (N, size * size) array with the glyphs
+    :param zones: the number of cells of the grid per side, it must divide the size
+    :return: the (N, 2 * size + zones * zones) features
+    """
+    glyphs = np.asarray(glyphs, dtype=np.float64)
+    size = int(np.sqrt(glyphs.shape[1]))
+    if size * size != glyphs.shape[1] or size % zones:
+        raise ValueError(f"Glyphs of {glyphs.shape[1]} values cannot be split into {zones} x {zones} zones")
+
+    glyphs = glyphs.reshape(len(glyphs), size, size)
+    cell = size // zones
+    zoning = glyphs.reshape(len(glyphs), zones, cell, zones, cell).mean(axis=(2, 4))
+
+    return np.hstack((glyphs.mean(axis=2), glyphs.mean(axis=1), zoning.reshape(len(glyphs), -1)))
+
+def fitPCA(glyphs, dimension=32):
+    """
+    Finds the principal components of the glyphs with an SVD of the centered glyphs.
+    :param glyphs: an (N, D) array with the training glyphs
+    :param dimension: the number of components to keep
+    :return: the reduction, a dictionary with the mean and the (dimension, D) components
+    """
+    glyphs = np.asarray(glyphs, dtype=np.float64)
+    mean = glyphs.mean(axis=0)
+    _, _, components = np.linalg.svd(glyphs - mean, full_matrices=False)
+
+    return {"method": "pca", "mean": mean, "components": components[:dimension]}
+
+def fitReduction(glyphs, method=None, dimension=32, zones=4):
+    """
+    Fits the reduction of the glyph features on the training glyphs.
+    :param glyphs: an (N, D) array with the training glyphs
+    :param method: None for the raw pixels, "pca" or "projection"
+    :param dimension: the number of components of PCA
+    :param zones: the number of zones per side of the projection features
+    :return: the reduction, None for the raw pixels
+    """
+    if method not in reduction_methods:
+        raise ValueError(f"Unknown reduction: {method}")
+
+    if method == "pca":
+        return fitPCA(glyphs, dimension)
+    if method == "projection":
+        return {"method": "projection", "zones": zones}
+    return None
+
+def applyReduction(reduction, glyphs):
+    """
+    Computes the reduced features of the glyphs, the same way for the training and the new glyphs.
+    :param reduction: the reduction of fitReduction, or None
+    :param glyphs: an (N, D) array with the glyphs
+    :return: the (N, dimension) features, the glyphs themselves without a reduction
+    """
+    if reduction is None:
+        return glyphs
+    if reduction["method"] == "projection":
+        return projectionFeatures(glyphs, reduction["zones"])
+
+    return (np.asarray(glyphs, dtype=np.float64) - reduction["mean"]) @ reduction["components"].T
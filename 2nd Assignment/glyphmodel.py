@@ -0,0 +1,290 @@
+import os
+import numpy as np
+from glyphfeatures import reduction_methods, fitReduction, applyReduction
+
+# The file starts with a 64 byte header, followed by the uint8 (N, D) quantized glyphs, the float64 (N,)
+# squared norms of the glyphs and the (N,) labels as fixed width UTF-32 strings, all little-endian.
+# A PCA reduction adds the float64 (input_dimension,) mean and (D, input_dimension) components at the end
+header_dtype = np.dtype([("magic", "S8"), ("count", "<u8"), ("dimension", "<u8"), ("label_width", "<u8"),
+                         ("k", "<u8"), ("scale", "<f8"), ("offset", "<f8"), ("reduction", "<u2"),
+                         ("zones", "<u2"), ("input_dimension", "<u4")])
+# The version is bumped whenever the training glyphs change, so the older model files are retrained
+magic = b"GLYPHS02"
+
+def fitQuantization(features):
+    """
+    Finds the linear quantization that maps the range of the features to 0-255.
+    The uint8 glyphs keep their values, so they are stored without any loss.
+    :param features: an (N, D) array with the features of the glyphs
+    :return: the scale and the offset, the quantized value is (value - offset) / scale
+    """
+    features = np.asarray(features)
+    if features.dtype == np.uint8 or features.size == 0:
+        return 1.0, 0.0
+
+    low, high = float(np.min(features)), float(np.max(features))
+    return (high - low) / 255 if high > low else 1.0, low
+
+def quantizeGlyphs(features, scale=1.0, offset=0.0):
+    """
+    Quantizes the features to uint8. The distances between quantized features are the distances
+    between the features divided by the scale, so the nearest neighbours stay the same up to rounding.
+    :param features: an (N, D) array with the features of the glyphs
+    :param scale, offset: the quantization of fitQuantization
+    :return: the (N, D) uint8 features
+    """
+    features = np.asarray(features)
+    if features.dtype == np.uint8 and scale == 1 and offset == 0:
+        return features
+
+    quantized = np.rint((features - offset) / scale)
+    return np.clip(quantized, 0, 255).astype(np.uint8)
+
+def saveGlyphModel(path, glyphs, labels, k=3, scale=1.0, offset=0.0, reduction=None):
+    """
+    Saves the reference glyphs of the classifier and their labels, without pickling.
+    :param path: the file path
+    :param glyphs: the (N, D) uint8 glyphs, e.g. from glyphBatch, or features quantized with quantizeGlyphs
+    :param labels: the N labels of the glyphs
+    :param k: the number of neighbours that vote for the label of a glyph
+    :param scale, offset: the quantization of the glyphs, applied to the glyphs to classify
+    :param reduction: the reduction of the features of fitReduction, applied before the quantization
+    """
+    glyphs = np.asarray(glyphs)
+    if glyphs.dtype != np.uint8 or glyphs.ndim != 2:
+        raise ValueError(f"The glyphs must be an (N, D) uint8 array, got {glyphs.dtype} of shape {glyphs.shape}")
+    labels = np.asarray(labels, dtype=str).reshape(-1)
+    if len(labels) != len(glyphs):
+        raise ValueError(f"Got {len(glyphs)} glyphs but {len(labels)} labels")
+    label_width = max(1, labels.dtype.itemsize // 4)
+
+    header = np.zeros((), dtype=header_dtype)
+    header["magic"] = magic
+    header["count"] = len(glyphs)
+    header["dimension"] = glyphs.shape[1]
+    header["label_width"] = label_width
+    header["k"] = k
+    header["scale"] = scale
+    header["offset"] = offset
+    if reduction is not None:
+        header["reduction"] = reduction_methods.index(reduction["method"])
+        header["zones"] = reduction.get("zones", 0)
+        header["input_dimension"] = len(reduction.get("mean", ()))
+
+    # The norms are stored, so loading the model never has to read all the glyphs
+    values = glyphs.astype(np.float64)
+    norms = np.einsum("ij,ij->i", values, values)
+
+    # Write to a temporary file first, so an interrupted write never leaves a broken file
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header.tobytes())
+        file.write(np.ascontiguousarray(glyphs).tobytes())
+        file.write(norms.astype("<f8").tobytes())
+        file.write(labels.astype(f"<U{label_width}").tobytes())
+        if reduction is not None and reduction["method"] == "pca":
+            file.write(reduction["mean"].astype("<f8").tobytes())
+            file.write(reduction["components"].astype("<f8").tobytes())
+    os.replace(temporary_path, path)
+
+def readGlyphHeader(path):
+    """
+    Reads the header of a glyph model file.
+    :param path: the file path
+    :return: a dictionary with the fields of the header
+    """
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) == 0 or header["magic"][0] != magic:
+        raise ValueError(f"{path} is not a glyph model file")
+
+    fields = {name: header[name][0].item() for name in header_dtype.names if name != "magic"}
+    if fields["reduction"] >= len(reduction_methods):
+        raise ValueError(f"{path} has an unknown reduction")
+
+    row_size = fields["dimension"] + 8 + 4 * fields["label_width"]
+    reduction_size = (fields["dimension"] + 1) * fields["input_dimension"] * 8
+    if os.path.getsize(path) < header_dtype.itemsize + fields["count"] * row_size + reduction_size:
+        raise ValueError(f"{path} is truncated")
+
+    return fields
+
+def glyphModelMatches(path, method=None, dimension=32):
+    """
+    Checks that a glyph model file exists and was trained with the given feature reduction.
+    :param path: the file path
+    :param method: the reduction of the features, None for the raw pixels, "pca" or "projection"
+    :param dimension: the number of components of PCA
+    :return: True if the model can be reused, False if it is missing, unreadable or has another reduction
+    """
+    try:
+        fields = readGlyphHeader(path)
+    except (OSError, ValueError):
+        return False
+
+    if reduction_methods[fields["reduction"]] != method:
+        return False
+    return method != "pca" or fields["dimension"] == dimension
+
+def loadGlyphModel(path, mmap=True):
+    """
+    Loads a glyph model file. With mmap the glyphs are a read-only view of the file, so loading takes
+    milliseconds and only the labels are read to find the classes.
+    :param path: the file path
+    :param mmap: True to memory-map the glyphs, False to read them into memory
+    :return: a dictionary with the glyphs, the norms, the labels, the sorted classes, the class of every glyph,
+    k, the quantization and the reduction
+    """
+    model = readGlyphHeader(path)
+    count, dimension, label_width = model["count"], model["dimension"], model["label_width"]
+    norms_offset = header_dtype.itemsize + count * dimension
+    labels_offset = norms_offset + count * 8
+
+    # An empty array cannot be memory-mapped
+    if mmap and count > 0 and dimension > 0:
+        glyphs = np.memmap(path, dtype=np.uint8, mode="r", offset=header_dtype.itemsize, shape=(count, dimension))
+    else:
+        glyphs = np.fromfile(path, dtype=np.uint8, count=count * dimension,
+                             offset=header_dtype.itemsize).reshape(count, dimension)
+    model["glyphs"] = glyphs
+    model["norms"] = np.fromfile(path, dtype="<f8", count=count, offset=norms_offset)
+    model["labels"] = np.fromfile(path, dtype=f"<U{label_width}", count=count, offset=labels_offset)
+    model["classes"], model["codes"] = np.unique(model["labels"], return_inverse=True)
+
+    method = reduction_methods[model.pop("reduction")]
+    zones, input_dimension = model.pop("zones"), model.pop("input_dimension")
+    if method == "pca":
+        mean_offset = labels_offset + count * 4 * label_width
+        mean = np.fromfile(path, dtype="<f8", count=input_dimension, offset=mean_offset)
+        components = np.fromfile(path, dtype="<f8", count=dimension * input_dimension,
+                                 offset=mean_offset + input_dimension * 8).reshape(dimension, input_dimension)
+        model["reduction"] = {"method": method, "mean": mean, "components": components}
+    elif method == "projection":
+        model["reduction"] = {"method": method, "zones": zones}
+    else:
+        model["reduction"] = None
+
+    return model
+
+def fitGlyphModel(glyphs, labels, k=3, method=None, dimension=32):
+    """
+    Builds the model of the classifier in memory, with the same fields as loadGlyphModel.
+    :param glyphs: the (N, D) uint8 training glyphs
+    :param labels: the N labels of the glyphs
+    :param k: the number of neighbours that vote for the label of a glyph
+    :param method: the reduction of the features, None for the raw pixels, "pca" or "projection"
+    :param dimension: the number of components of PCA
+    :return: the model
+    """
+    reduction = fitReduction(glyphs, method, dimension)
+    features = applyReduction(reduction, glyphs)
+    scale, offset = fitQuantization(features)
+    quantized = quantizeGlyphs(features, scale, offset)
+    values = quantized.astype(np.float64)
+    labels = np.asarray(labels, dtype=str).reshape(-1)
+
+    model = {"count": len(quantized), "dimension": quantized.shape[1],
+             "label_width": max(1, labels.dtype.itemsize // 4), "k": k, "scale": scale, "offset": offset,
+             "glyphs": quantized, "norms": np.einsum("ij,ij->i", values, values), "labels": labels,
+             "reduction": reduction}
+    model["classes"], model["codes"] = np.unique(labels, return_inverse=True)
+
+    return model
+
+def saveFittedModel(path, model):
+    """
+    Saves a model of fitGlyphModel.
+    :param path: the file path
+    :param model: the model
+    """
+    saveGlyphModel(path, model["glyphs"], model["labels"], model["k"], model["scale"], model["offset"],
+                   model["reduction"])
+
+def smallestColumns(block, k):
+    """
+    Finds the columns of the k smallest values of every row, without sorting the rows.
+    The lower column wins between equal values, unlike a plain np.argpartition.
+    :param block: an (N, M) array with M > k
+    :param k: the number of columns
+    :return: an (N, k) array with the columns of every row, in increasing order
+    """
+    kth = np.partition(block, k - 1, axis=1)[:, k - 1:k]
+    below = block < kth
+    tied = block == kth
+    # Only the first ties in column order fill the places that the smaller values leave
+    tied &= np.cumsum(tied, axis=1) <= k - np.count_nonzero(below, axis=1)[:, np.newaxis]
+
+    return np.nonzero(below | tied)[1].reshape(len(block), k)
+
+def glyphNeighbours(model, glyphs, k, block_size=2048):
+    """
+    Finds the k nearest reference glyphs of every glyph, block by block with
+    ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab, keeping a running top-k per glyph.
+    The lower index wins between equal distances.
+    :param model: the model of loadGlyphModel
+    :param glyphs: an (M, D) uint8 array with the quantized glyphs to classify
+    :param k: the number of neighbours
+    :param block_size: the maximum number of glyphs and reference glyphs of each block
+    :return: the (M, k) indices of the neighbours, sorted by distance
+    """
+    best_indices = np.full((len(glyphs), k), -1, dtype=np.int64)
+    best_distances = np.full((len(glyphs), k), np.inf)
+    reference = model["glyphs"]
+
+    for row_start in range(0, len(glyphs), block_size):
+        rows = slice(row_start, row_start + block_size)
+        queries = np.asarray(glyphs[rows], dtype=np.float64)
+        query_norms = np.einsum("ij,ij->i", queries, queries)
+
+        for col_start in range(0, len(reference), block_size):
+            cols = slice(col_start, col_start + block_size)
+
+            # The squared distances, the products of uint8 values are exact in float64
+            block = queries @ np.asarray(reference[cols], dtype=np.float64).T
+            block *= -2
+            block += query_norms[:, np.newaxis]
+            block += model["norms"][np.newaxis, cols]
+
+            # Take the k smallest distances of the block, without sorting the whole block
+            if block.shape[1] > k:
+                candidates = smallestColumns(block, k)
+            else:
+                candidates = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+
+            # Merge them with the running top-k
+            indices = np.concatenate((best_indices[rows], candidates + col_start), axis=1)
+            distances = np.concatenate((best_distances[rows], np.take_along_axis(block, candidates, axis=1)), axis=1)
+            order = np.lexsort((indices, distances), axis=1)[:, :k]
+
+            best_indices[rows] = np.take_along_axis(indices, order, axis=1)
+            best_distances[rows] = np.take_along_axis(distances, order, axis=1)
+
+    return best_indices
+
+def classifyGlyphs(model, glyphs, k=None, block_size=2048):
+    """
+    Labels the glyphs by the majority vote of their k nearest reference glyphs, like KNeighborsClassifier.
+    A tie goes to the first class in sorted order.
+    :param model: the model of loadGlyphModel
+    :param glyphs: an (M, D) array with the glyphs to classify, e.g. from glyphBatch, they are reduced
+    and quantized like the reference glyphs
+    :param k: the number of neighbours, by default the k of the model
+    :param block_size: the maximum number of glyphs and reference glyphs compared at once
+    :return: the (M,) labels
+    """
+    k = min(k or model["k"], model["count"])
+    if k == 0:
+        raise ValueError("The glyph model has no reference glyphs")
+
+    features = applyReduction(model["reduction"], np.asarray(glyphs).reshape(len(glyphs), -1))
+    glyphs = quantizeGlyphs(features, model["scale"], model["offset"])
+    if glyphs.shape[1] != model["dimension"]:
+        raise ValueError(f"The glyphs have {glyphs.shape[1]} values but the model has {model['dimension']}")
+
+    neighbours = glyphNeighbours(model, glyphs, k, block_size)
+
+    # Count the votes of every class with one bincount over all the glyphs
+    num_classes = len(model["classes"])
+    votes = model["codes"][neighbours] + np.arange(len(glyphs))[:, np.newaxis] * num_classes
+    counts = np.bincount(votes.ravel(), minlength=len(glyphs) * num_classes).reshape(len(glyphs), num_classes)
+
+    return model["classes"][np.argmax(counts, axis=1)]
@@ -0,0 +1,59 @@
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+def stackBoxes(letter_coordinates):
+    """
+    Joins the letters of all the lines into one array.
+    :param letter_coordinates: the list with the (K, 4) letters of every line, from detectLetters
+    :return: an (N, 4) array with all the letters [x1, y1, x2, y2]
+    """
+    lines = [np.reshape(line, (-1, 4)) for line in letter_coordinates]
+    return np.concatenate([np.empty((0, 4), dtype=np.intp)] + lines)
+
+def fillGlyphs(input_image, boxes, glyphs, start, stop, size):
+    """
+    Resizes the letters start to stop straight into their rows of the glyph matrix.
+    :param input_image: the image of the letters
+    :param boxes: the (N, 4) letters [x1, y1, x2, y2]
+    :param glyphs: the (N, size * size) glyph matrix
+    :param start, stop: the range of the letters
+    :param size: the side of the resized letters
+    """
+    for index in range(start, stop):
+        x1, y1, x2, y2 = boxes[index]
+        cv2.resize(input_image[y1:y2, x1:x2], (size, size), dst=glyphs[index].reshape(size, size),
+                   interpolation=cv2.INTER_CUBIC)
+
+def glyphBatch(input_image, boxes, size=32, workers=None, chunk_size=256, out=None):
+    """
+    Resizes every letter of the page to size x size and stores it as a row of one contiguous uint8 matrix,
+    the feature matrix of the classifier.
+    :param input_image: the grayscale image of the letters
+    :param boxes: an (N, 4) array with the letters [x1, y1, x2, y2], or the list of detectLetters
+    :param size: the side of the resized letters
+    :param workers: the number of threads that resize chunks of letters, None to resize them in this thread
+    :param chunk_size: the number of letters of each chunk
+    :param out: an (N, size * size) uint8 matrix to fill, by default a new one
+    :return: the (N, size * size) glyph matrix
+    """
+    if not isinstance(boxes, np.ndarray):
+        boxes = stackBoxes(boxes)
+    boxes = boxes.reshape(-1, 4)
+    glyphs = np.empty((len(boxes), size * size), dtype=np.uint8) if out is None else out
+    if glyphs.shape != (len(boxes), size * size) or glyphs.dtype != np.uint8 or not glyphs.flags.c_contiguous:
+        raise ValueError(f"The glyph matrix must be a contiguous ({len(boxes)}, {size * size}) uint8 array")
+
+    if workers is None or len(boxes) <= chunk_size:
+        fillGlyphs(input_image, boxes, glyphs, 0, len(boxes), size)
+        return glyphs
+
+    # cv2.resize releases the GIL, so the threads resize their chunks at the same time
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(fillGlyphs, input_image, boxes, glyphs, start,
+                               min(start + chunk_size, len(boxes)), size)
+                   for start in range(0, len(boxes), chunk_size)]
+        for future in futures:
+            future.result()
+
+    return glyphs
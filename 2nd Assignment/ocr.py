@@ -0,0 +1,160 @@
+import os
+import json
+import argparse
+import numpy as np
+import cv2
+import detect
+from glyphs import glyphBatch
+from glyphmodel import loadGlyphModel, classifyGlyphs
+
+# A gap between two letters wider than space_factor times the median gap of the line is a space
+space_factor = 2.5
+
+def pageRows(input_image, top, bottom, halo):
+    """
+    Converts the rows top to bottom of the page to grayscale, with halo more rows on each side where the
+    page has them, so the filters of the inner rows see the same pixels as on the whole page.
+    :param input_image: the given page, BGR or grayscale
+    :param top, bottom: the range of the rows
+    :param halo: the number of extra rows on each side
+    :return: the grayscale rows and the slice of the inner rows in them
+    """
+    start = max(top - halo, 0)
+    rows = detect.toGray(input_image[start:min(bottom + halo, input_image.shape[0])])
+    return rows, slice(top - start, bottom - start)
+
+def readPage(input_image, model, save_dir=None, band_height=256):
+    """
+    Reads the letters of a page line by line, with the same results as preprocessing the whole page at once.
+    The page is preprocessed in bands of rows: a first pass accumulates the histograms of the Otsu thresholds,
+    a second one the row sums that locate the lines, and then every line is preprocessed on its own rows.
+    Besides the given page, only one band or one line and the projection of the rows are held in memory,
+    so tall pages need no full-page buffers and the records can be consumed while the page is read.
+    :param input_image: the given page, BGR or grayscale
+    :param model: the glyph model of loadGlyphModel
+    :param save_dir: the directory to save the line and letter images in, None to save nothing
+    :param band_height: the number of rows of each band
+    :return: a generator of dictionaries with the line number, the box [x1, y1, x2, y2] in page coordinates,
+    the predicted character and whether a space comes before it
+    """
+    height = input_image.shape[0]
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+
+    # The thresholds of the whole page, from the histograms of all the bands,
+    # the gradient needs one more row on each side
+    text_histogram = np.zeros(256, dtype=np.int64)
+    gradient_histogram = np.zeros(256, dtype=np.int64)
+    for top in range(0, height, band_height):
+        rows, inner = pageRows(input_image, top, min(top + band_height, height), 1)
+        text_histogram += np.bincount(rows[inner].ravel(), minlength=256)
+        gradient_histogram += np.bincount(detect.gradientImage(rows)[inner].ravel(), minlength=256)
+    text_thresh = detect.otsuThreshold(text_histogram)
+    gradient_thresh = detect.otsuThreshold(gradient_histogram)
+
+    # The vertical projection of the connected image, the closing only connects the pixels of a row
+    vertical_projection = np.empty((height, 1), dtype=np.float32)
+    for top in range(0, height, band_height):
+        bottom = min(top + band_height, height)
+        rows, inner = pageRows(input_image, top, bottom, 1)
+        connected, _ = detect.preprocessImage(rows, gradient_thresh)
+        vertical_projection[top:bottom] = cv2.reduce(connected[inner], 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F)
+    peaks = detect.linePeaks(vertical_projection)
+
+    # One glyph matrix for all the lines, it only grows for a line with more letters
+    buffer = np.empty((0, 1024), dtype=np.uint8)
+    for i in range(1, len(peaks)):
+        y1, y2 = int(peaks[i-1]), int(peaks[i])
+
+        # The dilation and the erosion of preprocessText need two more rows on each side
+        rows, inner = pageRows(input_image, y1, y2, 2)
+        if save_dir is not None:
+            detect.saveLine(rows[inner], save_dir, i)
+        line = cv2.bitwise_not(detect.preprocessText(rows, text_thresh))[inner]
+
+        boxes = detect.splitLetters(line, save_dir, i) + [5, 0, 5, 0]
+        if len(boxes) == 0:
+            continue
+        if len(buffer) < len(boxes):
+            buffer = np.empty((len(boxes), 1024), dtype=np.uint8)
+
+        glyphs = glyphBatch(line, boxes, out=buffer[:len(boxes)])
+        characters = classifyGlyphs(model, glyphs)
+        boxes += [0, y1, 0, y1]
+
+        # The gap between two letters is the white run between them
+        gaps = boxes[1:, 0] - boxes[:-1, 2]
+        spaces = np.zeros(len(boxes), dtype=bool)
+        if len(gaps):
+            spaces[1:] = gaps > space_factor * max(np.median(gaps), 1)
+
+        for box, character, space in zip(boxes.tolist(), characters.tolist(), spaces.tolist()):
+            yield {"line": i, "box": box, "char": character, "space": space}
+
+def pageText(records):
+    """
+    Joins the records of readPage into the text of the page, with a new line for every line.
+    :param records: the records of readPage
+    :return: the text and the list of the records, each with the index of its character in the text
+    """
+    parts = []
+    characters = []
+    length = 0
+    line = None
+    for record in records:
+        if line is not None and record["line"] != line:
+            parts.append("\n")
+            length += 1
+        elif line is not None and record["space"]:
+            parts.append(" ")
+            length += 1
+        line = record["line"]
+
+        record["index"] = length
+        parts.append(record["char"])
+        length += len(record["char"])
+        characters.append(record)
+
+    return "".join(parts), characters
+
+def ocrPages(paths, model, save_dir=None):
+    """
+    Reads the text of every page, one page at a time.
+    :param paths: the paths of the page images
+    :param model: the glyph model of loadGlyphModel
+    :param save_dir: the directory to save the line and letter images in, one subdirectory per page,
+    None to save nothing
+    :return: a generator of dictionaries with the file, the text and the characters with their positions
+    """
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Could not read {path}")
+
+        page_dir = None
+        if save_dir is not None:
+            page_dir = os.path.join(save_dir, os.path.splitext(os.path.basename(path))[0])
+
+        text, characters = pageText(readPage(image, model, page_dir))
+        yield {"file": path, "text": text, "characters": characters}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read the text of scanned pages with a trained glyph model")
+    parser.add_argument("pages", nargs="+", help="the page images")
+    parser.add_argument("-m", "--model", default=detect.model_path, help="the glyph model of detect.py")
+    parser.add_argument("-o", "--output", default=None, help="the path of a JSON file with the character positions")
+    parser.add_argument("-s", "--save-dir", default=None, help="a directory to save the line and letter images in")
+    args = parser.parse_args()
+
+    glyph_model = loadGlyphModel(args.model)
+    results = []
+    for result in ocrPages(args.pages, glyph_model, args.save_dir):
+        print(result["file"])
+        print(result["text"])
+        if args.output:
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -1,5 +1,7 @@
 import cv2
 import numpy as np
+from spectrum import spectrumWorkspace, thresholdedSpectrum, spectrumProjection
+from transform import rotationMatrix, warpRegion
 
 debug = True
 
@@ -45,22 +47,18 @@ def preprocessImage(input_image):
 
     return connected_image, bw_image
 
-def findRotationAngle(input_image, disp_image):
+def findRotationAngle(input_image, disp_image, pad=False):
     """
     Find the angle of rotation of the image using DFT and magnitude spectrum
     :param disp_image: copy of the original image
     :param input_image: the preprocessed image
+    :param pad: if True, zero pad the image to a size that the FFT handles fast. It is faster, but the padding
+    changes the spectrum and can change the angle
     :return: the calculated angle for rotation
     """
-    height, width = input_image.shape[:2]
-
-    # Calculate the DFT of the image and shift the zero-freq component to the center of the spectrum
-    f = np.fft.fft2(input_image)
-    fshift = np.fft.fftshift(f)
-
-    # Calculate the magnitude spectrum of the DFT
-    magnitude_spectrum = 20 * np.log(np.abs(fshift))
-    mret, mthresh = cv2.threshold(magnitude_spectrum, 235, 255, cv2.THRESH_BINARY)
+    # Calculate the thresholded magnitude spectrum of the DFT, with the zero-freq component at the center
+    mthresh = thresholdedSpectrum(input_image, 235, pad=pad)
+    height, width = mthresh.shape[:2]
     # display(mthresh, "magnitude spectrum")
     src = mthresh
     src = np.array(src, dtype=np.int16)
@@ -71,7 +69,10 @@ def findRotationAngle(input_image, disp_image):
     # display(edges, "edges")
 
     lines = cv2.HoughLinesP(edges, 1, np.pi / 180, 5, np.array([]), minLineLength=20, maxLineGap=2)
-    lines = lines.squeeze()
+    if lines is None:
+        print("DFT angle", 0, "(no lines found)")
+        return 0
+    lines = lines.reshape(-1, 4)
 
     slope = np.array([])
     center = (width // 2, height // 2)
@@ -93,6 +94,11 @@ def findRotationAngle(input_image, disp_image):
 
     display(disp_image, "lines")
 
+    # Without lines away from the center there is no estimate, the serial search then looks around 0
+    if len(slope) == 0:
+        print("DFT angle", 0, "(no lines found)")
+        return 0
+
     slope = np.mean(slope)
     temp = np.degrees(np.arctan(slope))
 
@@ -107,40 +113,122 @@ def findRotationAngle(input_image, disp_image):
 
     return angle_degrees
 
-def serialSearch(input_image, angle_degrees):
+def rotatedSize(input_image, low, high):
     """
-    Through a serial search, find the desired angle of rotation of the image
+    Finds the largest size of the image rotated by rotateImage at any angle between low and high
     :param input_image: the given image
-    :param angle_degrees: the angle of rotation calculated by findRotationAngle
-    :return: the angle of rotation after the serial search
+    :param low, high: the range of the angles of rotation in degrees
+    :return: the largest height and width
     """
-    range_degrees = np.arange(np.int32(angle_degrees-10), np.int32(angle_degrees+10), 1)
-    variance_normalized_f = np.array([])
+    rows, cols = input_image.shape[:2]
+    radians = np.radians(np.linspace(low, high, int(np.ceil((high - low) / 0.1)) + 1))
+    cos_theta, sin_theta = np.abs(np.cos(radians)), np.abs(np.sin(radians))
+
+    return int(np.max(rows * cos_theta + cols * sin_theta)) + 1, int(np.max(rows * sin_theta + cols * cos_theta)) + 1
 
-    for possible_angle in range_degrees:
+def spectrumScore(input_image, possible_angle, thresh=235, workspace=None):
+    """
+    Rotates the image and computes the variance of the first derivative of the vertical projection
+    of its thresholded magnitude spectrum. The text lines are horizontal at the angle with the largest score.
+    :param input_image: the given image
+    :param possible_angle: the angle of rotation in degrees
+    :param thresh: the threshold of the magnitude spectrum
+    :param workspace: the workspace of spectrumWorkspace, shared by all the angles of a search
+    :return: the score of the angle
+    """
+    if workspace is None:
         rotated_img = rotateImage(input_image, possible_angle)
+    else:
+        # Rotate into a buffer of the workspace, that is reused by all the angles
+        M, (new_width, new_height) = rotationMatrix(input_image.shape, possible_angle,
+                                                    (input_image.shape[1] // 2, input_image.shape[0] // 2))
+        buffer = workspace.get("rotated")
+        if buffer is None or buffer.shape[0] < new_height or buffer.shape[1] < new_width:
+            buffer = workspace["rotated"] = np.empty((new_height, new_width), dtype=input_image.dtype)
+        rotated_img = warpRegion(input_image, M, (0, 0, new_width, new_height),
+                                 dst=buffer[:new_height, :new_width])
+
+    # Calculate the vertical projection of the thresholded magnitude spectrum of the DFT
+    vertical_projection = spectrumProjection(rotated_img, thresh, workspace, pad=False)
+
+    # Compute the first derivative of the vertical projection and the variance of the first derivative
+    d_vertical_projection = np.diff(vertical_projection)
+    return np.var(d_vertical_projection)
+
+def serialSearch(input_image, angle_degrees, mode="full", scale=4, candidates=3, tolerance=0.5, pad=False):
+    """
+    Through a serial search, find the desired angle of rotation of the image
+    :param input_image: the given image
+    :param angle_degrees: the angle of rotation calculated by findRotationAngle
+    :param mode: "full" to try every integer angle on the full image, or "coarse" to try them on an image
+    downsampled by scale, compare the best candidates on the full image and refine the best one
+    with a golden-section search
+    :param scale: the downsampling factor of the coarse mode
+    :param candidates: the number of the best coarse angles that are compared on the full image
+    :param tolerance: the accuracy in degrees of the refinement of the coarse mode
+    :param pad: if True, zero pad every rotated image to a size that the FFT handles fast. It is faster,
+    but the scores change a little and so can the chosen angle
+    :return: the angle of rotation after the serial search, an integer in the full mode
+    """
+    if mode not in ("full", "coarse"):
+        raise ValueError(f"Unknown search mode: {mode}")
 
-        # Calculate the DFT of the image and shift the zero-freq component to the center of the spectrum
-        f = np.fft.fft2(rotated_img)
-        fshift = np.fft.fftshift(f)
+    range_degrees = np.arange(np.int32(angle_degrees-10), np.int32(angle_degrees+10), 1)
 
-        # Calculate the magnitude spectrum of the DFT
-        magnitude_spectrum = 20 * np.log(np.abs(fshift))
-        mret, mthresh = cv2.threshold(magnitude_spectrum, 235, 255, cv2.THRESH_BINARY)
-        vertical_projection = np.sum(mthresh, axis=1)
+    # The spectra of all the angles share their buffers, the refinement of the coarse mode
+    # stays within one degree of the range
+    workspace = spectrumWorkspace(*rotatedSize(input_image, range_degrees[0] - 1, range_degrees[-1] + 1), pad)
 
-        # Compute the first derivative of the vertical projection and the variance of the first derivative
-        d_vertical_projection = np.diff(vertical_projection)
-        variance_normalized_f = np.append(variance_normalized_f, np.var(d_vertical_projection))
+    if mode == "full":
+        variance_normalized_f = np.array([spectrumScore(input_image, possible_angle, workspace=workspace)
+                                          for possible_angle in range_degrees])
+    else:
+        # The spectrum of an image that is scale times smaller is about scale^2 times weaker,
+        # so its log-magnitude threshold is lower by 20 * log(scale^2)
+        small_image = cv2.resize(input_image, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA)
+        small_workspace = spectrumWorkspace(*rotatedSize(small_image, range_degrees[0], range_degrees[-1]), pad)
+        variance_normalized_f = np.array([spectrumScore(small_image, possible_angle, 235 - 40 * np.log(scale),
+                                                        small_workspace)
+                                          for possible_angle in range_degrees])
 
     # Normalize the variance/sign_changes to the range [0, 1]
     variance_normalized = variance_normalized_f / np.max(variance_normalized_f)
 
-    index = np.argmax(variance_normalized)
-    calculated_angle = range_degrees[index]
+    if mode == "full":
+        index = np.argmax(variance_normalized)
+        calculated_angle = range_degrees[index]
+        print("serial angle", calculated_angle)
+
+        final_angle = np.int32((calculated_angle*0.5 + angle_degrees*0.1)/0.6)
+        print("final angle", final_angle)
+        return final_angle
+
+    # The scores of the small image are rougher, so the best few are compared again on the full image
+    best = np.argsort(-variance_normalized, kind="stable")[:candidates]
+    full_scores = [spectrumScore(input_image, possible_angle, workspace=workspace)
+                   for possible_angle in range_degrees[best]]
+    calculated_angle = range_degrees[best[np.argmax(full_scores)]]
     print("serial angle", calculated_angle)
 
-    final_angle = np.int32((calculated_angle*0.5 + angle_degrees*0.1)/0.6)
+    # Golden-section search for the best score within one degree of the best integer angle
+    ratio = (np.sqrt(5) - 1) / 2
+    low, high = calculated_angle - 1.0, calculated_angle + 1.0
+    left, right = high - ratio * (high - low), low + ratio * (high - low)
+    left_score = spectrumScore(input_image, left, workspace=workspace)
+    right_score = spectrumScore(input_image, right, workspace=workspace)
+    while high - low > tolerance:
+        if left_score >= right_score:
+            high, right, right_score = right, left, left_score
+            left = high - ratio * (high - low)
+            left_score = spectrumScore(input_image, left, workspace=workspace)
+        else:
+            low, left, left_score = left, right, right_score
+            right = low + ratio * (high - low)
+            right_score = spectrumScore(input_image, right, workspace=workspace)
+    calculated_angle = left if left_score >= right_score else right
+    print("refined angle", calculated_angle)
+
+    final_angle = float((calculated_angle*0.5 + angle_degrees*0.1)/0.6)
     print("final angle", final_angle)
 
     return final_angle
@@ -153,18 +241,10 @@ def rotateImage(input_image, rotation_angle):
     :return: the rotated image
     """
     rows, cols = input_image.shape[:2]
-    M = cv2.getRotationMatrix2D((cols // 2, rows // 2), rotation_angle, 1)
-
-    # Calculate new image dimensions
-    cos_theta = abs(M[0, 0])
-    sin_theta = abs(M[0, 1])
-    new_width = int((rows * sin_theta) + (cols * cos_theta))
-    new_height = int((rows * cos_theta) + (cols * sin_theta))
-
-    # Adjust the rotation matrix to take into account translation
-    M[0, 2] += (new_width / 2) - cols // 2
-    M[1, 2] += (new_height / 2) - rows // 2
-    rotated_img = cv2.warpAffine(input_image, M, (new_width, new_height))
+
+    # The rotation about the center pixel, on a canvas that holds the whole rotated image
+    M, new_size = rotationMatrix(input_image.shape, rotation_angle, (cols // 2, rows // 2))
+    rotated_img = cv2.warpAffine(input_image, M, new_size)
 
     return rotated_img
 
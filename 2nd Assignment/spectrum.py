@@ -0,0 +1,99 @@
+import numpy as np
+import cv2
+
+def spectrumShape(height, width, pad=True):
+    """
+    Gets the size of the FFT of a height x width image.
+    :param height, width: the size of the image
+    :param pad: if True, the image is zero padded to a size that the FFT handles fast
+    :return: the height and width of the FFT
+    """
+    if pad:
+        return cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width)
+    return height, width
+
+def spectrumWorkspace(height, width, pad=True):
+    """
+    Creates the buffers for the spectra of images up to height x width, so many calls reuse them.
+    :param height, width: the largest image size
+    :param pad: if True, the images are zero padded to sizes that the FFT handles fast
+    :return: the workspace, a dictionary with the padding, the input buffer and the half magnitude buffer
+    """
+    height, width = spectrumShape(height, width, pad)
+    return {"pad": pad, "input": np.zeros((height, width)), "magnitude": np.empty((height, width // 2 + 1))}
+
+def halfSpectrum(input_image, workspace=None, pad=True):
+    """
+    Computes the log-magnitude spectrum 20 * log(|F|) of a real image with a real FFT,
+    which only returns the columns 0 to width // 2 of the spectrum, since the rest are symmetric.
+    The result is a view of the workspace, it is overwritten by the next call.
+    :param input_image: the given image
+    :param workspace: the workspace of spectrumWorkspace, None for new buffers. Its buffers are enlarged in place
+    for an image that does not fit
+    :param pad: if True and without a workspace, zero pad the image to a size that the FFT handles fast
+    :return: the (height, width // 2 + 1) half spectrum, not shifted, and the full spectrum shape
+    """
+    height, width = input_image.shape[:2]
+    if workspace is None:
+        workspace = spectrumWorkspace(height, width, pad)
+    fft_height, fft_width = spectrumShape(height, width, workspace["pad"])
+    if fft_height > workspace["input"].shape[0] or fft_width > workspace["input"].shape[1]:
+        # Grow the buffers of the given workspace, so the next calls reuse them
+        workspace.update(spectrumWorkspace(max(height, workspace["input"].shape[0]),
+                                           max(width, workspace["input"].shape[1]), workspace["pad"]))
+
+    # Copy the image into the buffer and zero the padding
+    buffer = workspace["input"][:fft_height, :fft_width]
+    buffer[:height, :width] = input_image
+    buffer[height:, :] = 0
+    buffer[:height, width:] = 0
+
+    magnitude = workspace["magnitude"][:fft_height, :fft_width // 2 + 1]
+    np.abs(np.fft.rfft2(buffer), out=magnitude)
+    with np.errstate(divide="ignore"):
+        np.log(magnitude, out=magnitude)
+    magnitude *= 20
+
+    return magnitude, (fft_height, fft_width)
+
+def thresholdedSpectrum(input_image, thresh=235, workspace=None, pad=True):
+    """
+    Computes the thresholded and shifted magnitude spectrum of the image, like
+    cv2.threshold(20 * np.log(np.abs(np.fft.fftshift(np.fft.fft2(image)))), thresh, 255, cv2.THRESH_BINARY).
+    The missing half of the real FFT is mirrored after the threshold, F(u, v) = conj(F(-u, -v)).
+    :param input_image: the given image
+    :param thresh: the threshold of the magnitude spectrum
+    :param workspace: the workspace of spectrumWorkspace
+    :param pad: if True and without a workspace, zero pad the image to a size that the FFT handles fast
+    :return: the thresholded spectrum with values 0 and 255
+    """
+    magnitude, (height, width) = halfSpectrum(input_image, workspace, pad)
+    half = np.where(magnitude > thresh, 255.0, 0.0)
+
+    spectrum = np.empty((height, width))
+    spectrum[:, :width // 2 + 1] = half
+    mirrored_rows = -np.arange(height) % height
+    mirrored_cols = width - np.arange(width // 2 + 1, width)
+    spectrum[:, width // 2 + 1:] = half[mirrored_rows][:, mirrored_cols]
+
+    return np.fft.fftshift(spectrum)
+
+def spectrumProjection(input_image, thresh=235, workspace=None, pad=True):
+    """
+    Computes the vertical projection (the sum of every row) of the thresholded and shifted magnitude spectrum,
+    straight from the half spectrum of the real FFT. The mirrored columns 1 to width - width // 2 - 1
+    of row -u belong to row u.
+    :param input_image: the given image
+    :param thresh: the threshold of the magnitude spectrum
+    :param workspace: the workspace of spectrumWorkspace
+    :param pad: if True and without a workspace, zero pad the image to a size that the FFT handles fast
+    :return: the vertical projection
+    """
+    magnitude, (height, width) = halfSpectrum(input_image, workspace, pad)
+    above = magnitude > thresh
+
+    row_counts = np.count_nonzero(above, axis=1)
+    mirrored_counts = np.count_nonzero(above[:, 1:width - width // 2], axis=1)
+    projection = 255.0 * (row_counts + mirrored_counts[-np.arange(height) % height])
+
+    return np.fft.fftshift(projection)
@@ -92,7 +92,12 @@ def find_contours(connected_image, bw_image, textImg):
     """
     contours, hierarchy = cv2.findContours(connected_image.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
 
-    mask = np.zeros(bw_image.shape, dtype=np.uint8)
+    # fill every contour once with its own label, the external contours never overlap,
+    # so the pixels of each label are the non-zero pixels of its filled bounding box
+    labels = np.zeros(bw_image.shape, dtype=np.int32)
+    for idx in range(len(contours)):
+        cv2.drawContours(labels, contours, idx, idx + 1, -1)
+    filled = np.bincount(labels.ravel(), minlength=len(contours) + 1)[1:]
 
     # cumulative theta value
     cummTheta = 0
@@ -100,11 +105,8 @@ def find_contours(connected_image, bw_image, textImg):
     ct = 0
     for idx in range(len(contours)):
         x, y, w, h = cv2.boundingRect(contours[idx])
-        mask[y:y + h, x:x + w] = 0
-        # fill the contour
-        cv2.drawContours(mask, contours, idx, (255, 255, 255), -1)
         # ratio of non-zero pixels in the filled region
-        r = float(cv2.countNonZero(mask[y:y + h, x:x + w])) / (w * h)
+        r = float(filled[idx]) / (w * h)
 
         # assume at least 45% of the area is filled if it contains text
         if r > 0.45 and w > 8 and h > 8:
@@ -0,0 +1,59 @@
+import numpy as np
+import cv2
+
+def composite(canvas, overlay, origin, blend=None):
+    """
+    Places the overlay on the canvas in place. The black pixels of the overlay are transparent.
+    :param canvas: the (H, W, 3) background image, it is modified
+    :param overlay: the image to place, only its first 3 channels are used
+    :param origin: the (row, column) of the canvas where the top-left pixel of the overlay goes,
+    the parts of the overlay outside the canvas are cut off
+    :param blend: None to copy the overlay pixels, "feather" to weight the seam by the distance from the
+    borders of the two images, or "linear" for a linear ramp across the seam
+    :return: the canvas
+    """
+    if blend not in (None, "feather", "linear"):
+        raise ValueError(f"Unknown blending mode: {blend}")
+
+    # Cut the overlay to the part that falls inside the canvas
+    top, left = origin
+    height, width = overlay.shape[:2]
+    rows = slice(max(top, 0), min(top + height, canvas.shape[0]))
+    cols = slice(max(left, 0), min(left + width, canvas.shape[1]))
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        return canvas
+
+    overlay = overlay[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+    if overlay.ndim == 2:
+        overlay = cv2.cvtColor(overlay, cv2.COLOR_GRAY2BGR)
+    overlay = overlay[:, :, :3]
+    region = canvas[rows, cols]
+    mask = overlay.any(axis=2)
+
+    seam = mask & region.any(axis=2)
+    if blend is None or not seam.any():
+        region[mask] = overlay[mask]
+        return canvas
+
+    # The weight of the overlay in the seam
+    if blend == "feather":
+        overlay_distance = cv2.distanceTransform(mask.astype(np.uint8), cv2.DIST_L2, 3)
+        region_distance = cv2.distanceTransform(region.any(axis=2).astype(np.uint8), cv2.DIST_L2, 3)
+        weight = overlay_distance / np.maximum(overlay_distance + region_distance, 1e-6)
+    else:
+        seam_cols = np.flatnonzero(seam.any(axis=0))
+        ramp = (np.arange(seam.shape[1]) - seam_cols[0]) / max(seam_cols[-1] - seam_cols[0], 1)
+        # The ramp rises towards the side of the overlay that is not covered by the canvas
+        uncovered_cols = np.flatnonzero((mask & ~seam).any(axis=0))
+        if len(uncovered_cols) and uncovered_cols.mean() < seam_cols.mean():
+            ramp = 1 - ramp
+        weight = np.broadcast_to(np.clip(ramp, 0, 1), seam.shape)
+
+    only_overlay = mask & ~seam
+    region[only_overlay] = overlay[only_overlay]
+
+    weight = weight[seam][:, np.newaxis]
+    blended = weight * overlay[seam] + (1 - weight) * region[seam]
+    region[seam] = np.clip(np.rint(blended), 0, 255).astype(canvas.dtype)
+
+    return canvas
@@ -1,5 +1,6 @@
 import numpy as np
 import cv2
+from functools import lru_cache
 
 def myLocalDescriptor(img, p, r_min, r_max, r_step, num_points):
     """
@@ -12,29 +13,12 @@ def myLocalDescriptor(img, p, r_min, r_max, r_step, num_points):
     :param num_points: the number of points in each circle
     :return: descriptor that contains a value for each radius
     """
-    size = (r_max - r_min) // r_step
-    d = np.full((1, size), 1e20)
-
-    if p[0] + r_max > img.shape[1] or p[1] + r_max > img.shape[0] or p[0] - r_max < 0 or p[1] - r_max < 0:
-        return d
-
-    index = 0
-    for radius in range(r_min, r_max, r_step):
-        x_rho = []
-        for theta in range(0, 360, 360 // num_points):
-            x = int(p[0] + radius * np.cos(theta))
-            y = int(p[1] + radius * np.sin(theta))
-            x_rho.append(img[y, x])
-            # cv2.circle(img, (x, y), 1, (255, 0, 0))
-
-        d[0, index] = np.mean(x_rho)
-        index += 1
-    # cv2.imwrite('myDescriptor.jpeg', img)
-    return d
+    return myLocalDescriptorBatch(img, [p], r_min, r_max, r_step, num_points)
 
 def myLocalDescriptorUpgrade(img, p, r_min, r_max, r_step, num_points):
     """
-    Computes the local descriptor for each pixel in the image, based on our ideas
+    Computes the local descriptor for each pixel in the image, based on our ideas.
+    The points of the angles that are multiples of 20 count twice.
     :param img: the given grayscale image
     :param p: the given pixel
     :param r_min: the minimum radius
@@ -43,32 +27,71 @@ def myLocalDescriptorUpgrade(img, p, r_min, r_max, r_step, num_points):
     :param num_points: the number of points in the circle
     :return: descriptor
     """
-    size = (r_max - r_min) // r_step
-    d = np.full((1, size), 1e20)
+    return myLocalDescriptorBatch(img, [p], r_min, r_max, r_step, num_points, variant="weighted")
 
-    if p[0] + r_max > img.shape[1] or p[1] + r_max > img.shape[0] or p[0] - r_max < 0 or p[1] - r_max < 0:
-        return d
+@lru_cache(maxsize=32)
+def ringOffsets(r_min, r_max, r_step, num_points, variant="circle"):
+    """
+    Computes the integer pixel offsets of the sample points of every circle, once per configuration.
+    Since the pixels are inside the image, int(p + offset) is equal to p + floor(offset).
+    The tables of the last 32 configurations are kept, ringOffsets.cache_info() reports the hits and misses.
+    :param r_min, r_max, r_step: the radii of the circles
+    :param num_points: the number of points in each circle
+    :param variant: "circle" for myLocalDescriptor or "weighted" for myLocalDescriptorUpgrade
+    :return: the x and y offsets, two read-only (n_radii, n_angles) arrays, and the weight of each angle
+    """
+    if variant not in ("circle", "weighted"):
+        raise ValueError(f"Unknown descriptor variant: {variant}")
 
-    index = 0
-    for rho in range(r_min, r_max, r_step):
-        x_rho = []
-        for theta in range(0, 360, 360 // num_points):
-            if (theta % 20) == 0:
-                x = int(p[0] + rho * np.cos(theta))
-                y = int(p[1] + rho * np.sin(theta))
-                x_rho.append(img[x, y] * 2)
-            else:
-                x = int(p[0] + rho * np.cos(theta))
-                y = int(p[1] + rho * np.sin(theta))
-                x_rho.append(img[x, y])
+    radius = np.arange(r_min, r_max, r_step)[:, np.newaxis]
+    theta = np.arange(0, 360, 360 // num_points)[np.newaxis, :]
 
-            # cv2.circle(img, (x, y), 1, (255, 0, 0))
-        d[0, index] = np.mean(x_rho)
-        index += 1
+    dx = np.floor(radius * np.cos(theta)).astype(np.int64)
+    dy = np.floor(radius * np.sin(theta)).astype(np.int64)
 
-    # cv2.imwrite('myDescriptorUpgrade.jpeg', img)
-    return d
+    # The weights are int64, so the doubled samples do not wrap around, like the pixel * 2 of the loop
+    # that numpy 1.x promotes out of uint8
+    weights = np.ones(theta.shape, dtype=np.int64)
+    if variant == "weighted":
+        weights[theta % 20 == 0] = 2
+
+    for table in (dx, dy, weights):
+        table.setflags(write=False)
 
+    return dx, dy, weights
+
+def myLocalDescriptorBatch(img, points, r_min, r_max, r_step, num_points, fill=1e20, variant="circle"):
+    """
+    Computes the local descriptor of many pixels at once, with the same circles as myLocalDescriptor.
+    :param img: the given grayscale image
+    :param points: an (N, 2) array with the pixels [x, y]
+    :param r_min: the minimum radius
+    :param r_max: the maximum radius
+    :param r_step: the step of the radius
+    :param num_points: the number of points in each circle
+    :param fill: the value of the descriptors of the pixels that are too close to the border
+    :param variant: "circle" for myLocalDescriptor or "weighted" for myLocalDescriptorUpgrade
+    :return: an (N, n_radii) array that contains a value for each radius of each pixel
+    """
+    dx, dy, weights = ringOffsets(r_min, r_max, r_step, num_points, variant)
+    points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+    height, width = img.shape[:2]
+    d = np.full((len(points), dx.shape[0]), fill, dtype=np.float64)
+
+    # Keep only the pixels whose circles lie fully inside the image
+    x, y = points[:, 0], points[:, 1]
+    inside = (x + r_max <= width) & (y + r_max <= height) & (x - r_max >= 0) & (y - r_max >= 0)
+    x, y = x[inside, np.newaxis, np.newaxis], y[inside, np.newaxis, np.newaxis]
+
+    if variant == "circle":
+        # Gather all the sample points with a single index into the flattened image
+        samples = np.ravel(img)[(y + dy) * width + (x + dx)]
+    else:
+        # The upgraded descriptor indexes the image as img[x, y]
+        samples = img[x + dx, y + dy] * weights
+    d[inside] = samples.mean(axis=2)
+
+    return d
 
 if __name__ == "__main__":
     # Parameters for the local descriptor
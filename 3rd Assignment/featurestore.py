@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import numpy as np
+from keypoints import saveKeypoints, loadKeypoints
+
+def featureParams(r_min, r_max, r_step, num_points, k=0.04, r_thresh=0.25, offset=4, levels=1):
+    """
+    Builds the parameters of featureKey, the same way for every tool, so they share the stored features.
+    :param r_min, r_max, r_step, num_points: the parameters for the local descriptor
+    :param k, r_thresh, offset, levels: the parameters for the Harris detector
+    :return: a dictionary with the detector and descriptor parameters
+    """
+    return {"k": k, "r_thresh": r_thresh, "offset": offset, "levels": levels, "r_min": r_min, "r_max": r_max,
+            "r_step": r_step, "num_points": num_points}
+
+def featureKey(image, params):
+    """
+    Computes the key of the features of an image, from its pixels and the parameters that produce them.
+    :param image: the given image
+    :param params: a dictionary with the detector and descriptor parameters
+    :return: the hexadecimal key
+    """
+    image = np.ascontiguousarray(image)
+    digest = hashlib.sha256()
+    digest.update(str((image.shape, image.dtype.str)).encode())
+    digest.update(image.data)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+def loadFeatures(cache_dir, key):
+    """
+    Loads the features with the given key from the store.
+    :param cache_dir: the directory of the store
+    :param key: the key of featureKey
+    :return: a dictionary with the memory-mapped corners and descriptor, or None if they are not stored
+    """
+    path = os.path.join(cache_dir, key + ".kpd")
+    try:
+        features = loadKeypoints(path)
+    except (OSError, ValueError):
+        return None
+
+    # Mark the entry as recently used for the eviction
+    os.utime(path)
+    return features
+
+def saveFeatures(cache_dir, key, features, max_bytes=None):
+    """
+    Saves the features in the store as keypoint files and evicts the least recently used entries
+    when the store is larger than max_bytes.
+    :param cache_dir: the directory of the store
+    :param key: the key of featureKey
+    :param features: a dictionary with the corners and the descriptor
+    :param max_bytes: the maximum size of the store, None for no limit
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + ".kpd")
+    saveKeypoints(path, features["corners"], features["descriptor"])
+
+    if max_bytes is not None:
+        evictFeatures(cache_dir, max_bytes, keep=path)
+
+def evictFeatures(cache_dir, max_bytes, keep=None):
+    """
+    Removes the least recently used entries until the store is not larger than max_bytes.
+    :param cache_dir: the directory of the store
+    :param max_bytes: the maximum size of the store
+    :param keep: an entry that is never removed
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".kpd"):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
+
+def cachedFeatures(image, params, compute, cache_dir="feature_cache", max_bytes=1 << 30):
+    """
+    Returns the features of the image from the store, or computes and stores them.
+    :param image: the given image
+    :param params: a dictionary with the detector and descriptor parameters
+    :param compute: a function without arguments that computes the features dictionary
+    :param cache_dir: the directory of the store
+    :param max_bytes: the maximum size of the store
+    :return: a dictionary with the corners and the descriptor
+    """
+    key = featureKey(image, params)
+    features = loadFeatures(cache_dir, key)
+    if features is None:
+        features = compute()
+        saveFeatures(cache_dir, key, features, max_bytes)
+
+    return features
@@ -0,0 +1,174 @@
+import time
+import numpy as np
+import cv2
+from integral import integralProducts, windowSums
+
+def harrisResponse(img_gaussian, k, offset):
+    """
+    Computes the Harris response of every pixel at once, using summed-area tables for the window sums.
+    The layout matches the per-pixel loop: the response of pixel (x, y) is stored at [y - offset, x - offset]
+    and the last 2 * offset rows and columns are left at zero.
+    :param img_gaussian: the smoothed grayscale image
+    :param k: the Harris detector free parameter
+    :param offset: half the size of the summation window
+    :return: matrix_R with the (not normalized) response values
+    """
+    height, width = img_gaussian.shape[:2]
+    matrix_R = np.zeros((height, width))
+    if height <= 2 * offset or width <= 2 * offset:
+        return matrix_R
+
+    # Calculate the x and y image derivatives
+    dx = cv2.Sobel(img_gaussian, cv2.CV_64F, 1, 0, ksize=5)
+    dy = cv2.Sobel(img_gaussian, cv2.CV_64F, 0, 1, ksize=5)
+
+    # Sum the products of the derivatives over every (2*offset+1)^2 window that lies fully inside the image,
+    # the window with top-left corner (x - offset, y - offset) is centered at pixel (x, y)
+    size = 2 * offset + 1
+    Sx2 = windowSums(integralProducts(dx), size)
+    Sy2 = windowSums(integralProducts(dy), size)
+    Sxy = windowSums(integralProducts(dx, dy), size)
+
+    # Calculate the response function ( R=det(H)-k(Trace(H))^2 )
+    matrix_R[:height - 2 * offset, :width - 2 * offset] = Sx2 * Sy2 - Sxy ** 2 - k * (Sx2 + Sy2) ** 2
+
+    return matrix_R
+
+def harrisCorners(matrix_R, r_thresh, offset):
+    """
+    Thresholds the normalized response and returns the corners in row-major order.
+    :param matrix_R: the normalized response of harrisResponse
+    :param r_thresh: the threshold for the normalized response
+    :param offset: half the size of the summation window
+    :return: an (N, 2) array with the corners [x, y]
+    """
+    height, width = matrix_R.shape[:2]
+    ys, xs = np.nonzero(matrix_R[offset:height - offset, offset:width - offset] > r_thresh)
+
+    return np.column_stack((xs + offset, ys + offset))
+
+def suppressNonMaxima(matrix_R, r_thresh, offset, radius):
+    """
+    Thresholds the normalized response and keeps only the corners that are the maximum of their
+    (2*radius+1)^2 neighbourhood, using a max filter over the whole response.
+    :param matrix_R: the normalized response of harrisResponse
+    :param r_thresh: the threshold for the normalized response
+    :param offset: half the size of the summation window
+    :param radius: half the size of the suppression window
+    :return: an (N, 2) array with the corners [x, y]
+    """
+    kernel = np.ones((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+    local_max = cv2.dilate(matrix_R, kernel)
+
+    height, width = matrix_R.shape[:2]
+    inner = (slice(offset, height - offset), slice(offset, width - offset))
+    ys, xs = np.nonzero((matrix_R[inner] > r_thresh) & (matrix_R[inner] == local_max[inner]))
+
+    return np.column_stack((xs + offset, ys + offset))
+
+def tileResponse(img_gaussian, k, offset, rows, cols):
+    """
+    Computes the Harris response of the given block of matrix_R only, from a crop of the image with
+    enough margin for the Sobel kernel and the summation window, so the values equal those of harrisResponse.
+    :param img_gaussian: the smoothed grayscale image
+    :param k: the Harris detector free parameter
+    :param offset: half the size of the summation window
+    :param rows, cols: the slices of the block of matrix_R
+    :return: the block of matrix_R
+    """
+    height, width = img_gaussian.shape[:2]
+    top, left = max(rows.start - 2, 0), max(cols.start - 2, 0)
+    bottom = min(rows.stop + 2 * offset + 2, height)
+    right = min(cols.stop + 2 * offset + 2, width)
+
+    crop_R = harrisResponse(img_gaussian[top:bottom, left:right], k, offset)
+    return crop_R[rows.start - top:rows.stop - top, cols.start - left:cols.stop - left]
+
+def refineCorners(img_gaussian, corners, k, offset, radius, tile_size=64):
+    """
+    Moves every corner to the maximum of the Harris response in its (2*radius+2)^2 neighbourhood.
+    The response is computed only around the neighbourhoods, one tile at a time.
+    :param img_gaussian: the smoothed grayscale image
+    :param corners: an (N, 2) array with the approximate corners [x, y], in the layout of harrisCorners
+    :param k: the Harris detector free parameter
+    :param offset: half the size of the summation window
+    :param radius: the distance that a corner can move
+    :param tile_size: the size of the tiles that group the neighbourhoods
+    :return: an (M, 2) array with the refined corners [x, y] without duplicates, and the number of patches computed
+    """
+    height, width = img_gaussian.shape[:2]
+    # The corners of harrisCorners lie in [offset, size - offset), with a response only below size - 2 * offset
+    last_y, last_x = height - 2 * offset - 1, width - 2 * offset - 1
+    if len(corners) == 0 or last_y < offset or last_x < offset:
+        return np.empty((0, 2), dtype=np.int64), 0
+
+    steps = np.arange(-radius, radius + 2)
+    xs = np.clip(corners[:, 0:1, np.newaxis] + steps[np.newaxis, :], offset, last_x)
+    ys = np.clip(corners[:, 1:2, np.newaxis] + steps[:, np.newaxis], offset, last_y)
+    xs, ys = np.broadcast_arrays(xs, ys)
+
+    # Compute the response one tile at a time, only on the bounding box of the neighbourhood pixels
+    # of the tile, so the response is never held at full resolution
+    tiles_per_row = width // tile_size + 1
+    flat_y, flat_x = ys.ravel(), xs.ravel()
+    owner = (flat_y // tile_size) * tiles_per_row + flat_x // tile_size
+    order = np.argsort(owner, kind="stable")
+    tiles, starts = np.unique(owner[order], return_index=True)
+    responses = np.empty(len(owner))
+    for indices in np.split(order, starts[1:]):
+        rows = slice(int(flat_y[indices].min()), int(flat_y[indices].max()) + 1)
+        cols = slice(int(flat_x[indices].min()), int(flat_x[indices].max()) + 1)
+        patch = tileResponse(img_gaussian, k, offset, rows, cols)
+        responses[indices] = patch[flat_y[indices] - rows.start, flat_x[indices] - cols.start]
+
+    neighbourhoods = responses.reshape(len(corners), -1)
+    best = np.argmax(neighbourhoods, axis=1)
+    refined = np.column_stack((xs.reshape(len(corners), -1)[np.arange(len(corners)), best],
+                               ys.reshape(len(corners), -1)[np.arange(len(corners)), best]))
+
+    return np.unique(refined, axis=0), len(tiles)
+
+def pyramidHarris(img_gaussian, k, r_thresh, offset, levels=3, detect_levels=1, radius=1, tile_size=64):
+    """
+    Detects the corners on the coarse levels of an image pyramid and refines their location level by level,
+    so the finer levels are only computed around the corners. Every level is half the size of the previous one
+    and uses the same window, so the coarser levels find the larger corners.
+    :param img_gaussian: the smoothed grayscale image
+    :param k: the Harris detector free parameter
+    :param r_thresh: the threshold for the normalized response of the detection levels
+    :param offset: half the size of the summation window
+    :param levels: the number of pyramid levels, 1 is the full resolution detection
+    :param detect_levels: the number of the coarsest levels where the corners are detected
+    :param radius: the distance that a corner can move on each level
+    :param tile_size: the size of the tiles that are computed on the refinement levels
+    :return: an (N, 2) array with the corners [x, y] in the layout of harrisCorners, and a list with the
+    level, shape, number of detected corners, number of corners, number of tiles and seconds of every level
+    """
+    pyramid = [img_gaussian]
+    while len(pyramid) < levels and min(pyramid[-1].shape[:2]) // 2 > 4 * offset:
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+
+    corners = np.empty((0, 2), dtype=np.int64)
+    stats = []
+    for level in range(len(pyramid) - 1, -1, -1):
+        start = time.perf_counter()
+        image = pyramid[level]
+        num_tiles = 0
+
+        # The pixel of a corner [x, y] is [x + offset, y + offset], it is twice as far on the finer level
+        if len(corners):
+            corners, num_tiles = refineCorners(image, 2 * corners + offset, k, offset, radius, tile_size)
+
+        num_detected = 0
+        if level >= len(pyramid) - detect_levels:
+            matrix_R = harrisResponse(image, k, offset)
+            cv2.normalize(matrix_R, matrix_R, 0, 1, cv2.NORM_MINMAX)
+            detected = harrisCorners(matrix_R, r_thresh, offset)
+            num_detected = len(detected)
+            corners = np.unique(np.concatenate((corners, detected)), axis=0)
+
+        stats.append({"level": level, "shape": image.shape[:2], "detected": num_detected, "corners": len(corners),
+                      "tiles": num_tiles, "seconds": time.perf_counter() - start})
+
+    # Return the corners in row-major order, like harrisCorners
+    return corners[np.lexsort((corners[:, 0], corners[:, 1]))], stats
@@ -0,0 +1,37 @@
+import numpy as np
+
+def integralImage(img):
+    """
+    Computes the summed-area table of the image. The table has one extra leading row and column of zeros,
+    so the sum of img[y1:y2, x1:x2] is sat[y2, x2] - sat[y1, x2] - sat[y2, x1] + sat[y1, x1].
+    :param img: the given 2D array
+    :return: the (height + 1, width + 1) float64 summed-area table
+    """
+    height, width = img.shape[:2]
+    sat = np.zeros((height + 1, width + 1))
+    np.cumsum(img, axis=0, dtype=np.float64, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+
+    return sat
+
+def integralProducts(a, b=None):
+    """
+    Computes the summed-area table of the element-wise product of two arrays.
+    :param a: the first 2D array
+    :param b: the second 2D array, if None the table of the squared values of a is returned
+    :return: the summed-area table of a * b
+    """
+    a = np.asarray(a, dtype=np.float64)
+    if b is None:
+        return integralImage(np.square(a))
+
+    return integralImage(a * np.asarray(b, dtype=np.float64))
+
+def windowSums(sat, size):
+    """
+    Returns the sums of all the size x size windows that lie fully inside the image.
+    :param sat: the summed-area table of integralImage
+    :param size: the side of the square window
+    :return: an array where [y, x] holds the sum of the window with top-left corner (x, y)
+    """
+    return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
@@ -0,0 +1,145 @@
+import heapq
+import numpy as np
+
+def buildKDTree(points, ids=None, leaf_size=16):
+    """
+    Builds a KD-tree over the given points. The tree is a dictionary of plain arrays, so it can be
+    saved with saveKDTree and reused for many queries.
+    :param points: an (N, D) array with the points, e.g. the descriptors of the reference image
+    :param ids: the id returned for each point, by default its row in points
+    :param leaf_size: the maximum number of points in each leaf
+    :return: the tree
+    """
+    points = np.asarray(points, dtype=np.float64)
+    ids = np.arange(len(points)) if ids is None else np.asarray(ids, dtype=np.int64)
+    order = np.arange(len(points))
+
+    # Every node covers order[start:end], the leaves have no children (-1)
+    split_dim, split_value, left, right, start, end = [], [], [], [], [], []
+    stack = [(0, len(points), -1, False)]
+
+    while stack:
+        node_start, node_end, parent, is_right = stack.pop()
+        node = len(start)
+        split_dim.append(-1)
+        split_value.append(0.0)
+        left.append(-1)
+        right.append(-1)
+        start.append(node_start)
+        end.append(node_end)
+        if parent >= 0:
+            if is_right:
+                right[parent] = node
+            else:
+                left[parent] = node
+
+        if node_end - node_start <= leaf_size:
+            continue
+
+        # Split at the median of the dimension with the largest spread
+        node_points = points[order[node_start:node_end]]
+        dim = int(np.argmax(node_points.max(axis=0) - node_points.min(axis=0)))
+        median = (node_end - node_start) // 2
+        partition = np.argpartition(node_points[:, dim], median)
+        order[node_start:node_end] = order[node_start:node_end][partition]
+
+        split_dim[node] = dim
+        split_value[node] = points[order[node_start + median], dim]
+        stack.append((node_start + median, node_end, node, True))
+        stack.append((node_start, node_start + median, node, False))
+
+    return {
+        "points": points[order],
+        "ids": ids[order],
+        "split_dim": np.array(split_dim, dtype=np.int64),
+        "split_value": np.array(split_value, dtype=np.float64),
+        "left": np.array(left, dtype=np.int64),
+        "right": np.array(right, dtype=np.int64),
+        "start": np.array(start, dtype=np.int64),
+        "end": np.array(end, dtype=np.int64),
+    }
+
+def saveKDTree(tree, path):
+    """
+    Saves the tree as a .npz file of plain arrays.
+    :param tree: the tree of buildKDTree
+    :param path: the file path
+    """
+    np.savez(path, **tree)
+
+def loadKDTree(path):
+    """
+    Loads a tree that was saved with saveKDTree.
+    :param path: the file path
+    :return: the tree
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def queryKDTree(tree, queries, k=1, max_checks=None):
+    """
+    Finds the k nearest points of the tree for every query, visiting the closest leaves first.
+    :param tree: the tree of buildKDTree
+    :param queries: an (M, D) array with the query points
+    :param k: the number of neighbours
+    :param max_checks: the maximum number of leaves visited per query, None for an exact search
+    :return: (M, k) arrays with the ids and the Euclidean distances of the neighbours, sorted by distance,
+    equal distances by id
+    """
+    queries = np.asarray(queries, dtype=np.float64)
+    indices = np.full((len(queries), k), -1, dtype=np.int64)
+    distances = np.full((len(queries), k), np.inf)
+    if len(tree["points"]) == 0:
+        return indices, distances
+
+    points, ids = tree["points"], tree["ids"]
+    split_dim, split_value = tree["split_dim"].tolist(), tree["split_value"].tolist()
+    left, right = tree["left"].tolist(), tree["right"].tolist()
+    start, end = tree["start"].tolist(), tree["end"].tolist()
+
+    for q, query in enumerate(queries):
+        values = query.tolist()
+        # Max-heap of the k best (negative squared distance, id) pairs
+        best = []
+        # Min-heap of the nodes to visit, each with a lower bound of its squared distance from the query
+        # and the per-dimension offsets of the query from its cell that make up the bound
+        heap = [(0.0, 0, 0, [0.0] * len(values))]
+        pushed = 1
+        checks = 0
+
+        while heap:
+            bound, _, node, offsets = heapq.heappop(heap)
+            if len(best) == k and bound > -best[0][0]:
+                break
+
+            # Go down to the leaf of the query and queue the other side of every split
+            while split_dim[node] >= 0:
+                dim = split_dim[node]
+                diff = values[dim] - split_value[node]
+                near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+
+                far_offsets = offsets.copy()
+                far_offsets[dim] = diff
+                heapq.heappush(heap, (bound - offsets[dim] ** 2 + diff * diff, pushed, far, far_offsets))
+                pushed += 1
+                node = near
+
+            # Only the points closer than the current k-th neighbour, or as close with a lower id, can enter the heap,
+            # so the ties go to the lowest id like in the brute-force search
+            leaf_distances = np.sum((points[start[node]:end[node]] - query) ** 2, axis=1)
+            closer = np.flatnonzero(leaf_distances <= (-best[0][0] if len(best) == k else np.inf))
+            for distance, point_id in zip(leaf_distances[closer].tolist(), ids[start[node] + closer].tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, -point_id))
+                elif (-distance, -point_id) > best[0]:
+                    heapq.heapreplace(best, (-distance, -point_id))
+
+            checks += 1
+            if max_checks is not None and checks >= max_checks:
+                break
+
+        best = sorted((-distance, -point_id) for distance, point_id in best)
+        indices[q, :len(best)] = [point_id for _, point_id in best]
+        distances[q, :len(best)] = np.sqrt([distance for distance, _ in best])
+
+    return indices, distances
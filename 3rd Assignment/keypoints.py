@@ -0,0 +1,97 @@
+import os
+import numpy as np
+
+# The file starts with a 32 byte header, followed by the int32 (N, 2) corners [x, y]
+# and the float32 (N, D) descriptors, both little-endian and row by row
+header_dtype = np.dtype([("magic", "S8"), ("count", "<u8"), ("dimension", "<u8"), ("reserved", "<u8")])
+magic = b"KPDESC01"
+
+def saveKeypoints(path, corners, descriptor):
+    """
+    Saves the corners and their descriptors in the keypoint file format, without pickling.
+    :param path: the file path
+    :param corners: the N corners [x, y]
+    :param descriptor: the (N, D) descriptors of the corners
+    """
+    corners = np.asarray(corners, dtype="<i4").reshape(-1, 2)
+    descriptor = np.asarray(descriptor, dtype="<f4")
+    if descriptor.size == 0 and descriptor.ndim == 1:
+        descriptor = descriptor.reshape(0, 0)
+    if descriptor.ndim != 2 or len(descriptor) != len(corners):
+        raise ValueError(f"Got {len(corners)} corners but descriptors of shape {descriptor.shape}")
+
+    header = np.zeros((), dtype=header_dtype)
+    header["magic"] = magic
+    header["count"] = len(corners)
+    header["dimension"] = descriptor.shape[1]
+
+    # Write to a temporary file first, so an interrupted write never leaves a broken file
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header.tobytes())
+        file.write(np.ascontiguousarray(corners).tobytes())
+        file.write(np.ascontiguousarray(descriptor).tobytes())
+    os.replace(temporary_path, path)
+
+def readHeader(path):
+    """
+    Reads the header of a keypoint file.
+    :param path: the file path
+    :return: the number of corners and the dimension of the descriptors
+    """
+    header = np.fromfile(path, dtype=header_dtype, count=1)
+    if len(header) == 0 or header["magic"][0] != magic:
+        raise ValueError(f"{path} is not a keypoint file")
+
+    count, dimension = int(header["count"][0]), int(header["dimension"][0])
+    if os.path.getsize(path) < header_dtype.itemsize + count * (2 + dimension) * 4:
+        raise ValueError(f"{path} is truncated")
+
+    return count, dimension
+
+def loadKeypoints(path, mmap=True):
+    """
+    Loads a keypoint file. With mmap the arrays are read-only views of the file, so opening is instant
+    and only the rows that are used are read from the disk.
+    :param path: the file path
+    :param mmap: True to memory-map the file, False to read it into memory
+    :return: a dictionary with the (N, 2) int32 corners and the (N, D) float32 descriptor
+    """
+    count, dimension = readHeader(path)
+    corners_offset = header_dtype.itemsize
+    descriptor_offset = corners_offset + count * 2 * 4
+
+    # An empty array cannot be memory-mapped
+    if mmap and count > 0 and dimension > 0:
+        corners = np.memmap(path, dtype="<i4", mode="r", offset=corners_offset, shape=(count, 2))
+        descriptor = np.memmap(path, dtype="<f4", mode="r", offset=descriptor_offset, shape=(count, dimension))
+    else:
+        corners = np.fromfile(path, dtype="<i4", count=count * 2, offset=corners_offset).reshape(count, 2)
+        descriptor = np.fromfile(path, dtype="<f4", count=count * dimension,
+                                 offset=descriptor_offset).reshape(count, dimension)
+
+    return {"corners": corners, "descriptor": descriptor}
+
+def convertLegacyKeypoints(npy_path, path):
+    """
+    Converts the pickled dictionary of np.save, e.g. the old img1.npy, to the keypoint file format.
+    Only use it on trusted files, since loading them unpickles arbitrary objects.
+    :param npy_path: the path of the .npy file
+    :param path: the path of the keypoint file
+    """
+    features = np.load(npy_path, allow_pickle=True).item()
+    saveKeypoints(path, features["corners"], features["descriptor"])
+
+def loadOrConvertKeypoints(path, npy_path, mmap=True):
+    """
+    Loads a keypoint file, and creates it first from the pickled .npy file of the same features if it is missing.
+    The keypoint files are generated, only the .npy files are kept in the repository.
+    :param path: the path of the keypoint file
+    :param npy_path: the path of the .npy file, e.g. img1.npy
+    :param mmap: True to memory-map the file, False to read it into memory
+    :return: the dictionary of loadKeypoints
+    """
+    if not os.path.exists(path):
+        convertLegacyKeypoints(npy_path, path)
+
+    return loadKeypoints(path, mmap)
@@ -1,5 +1,8 @@
 import numpy as np
 import cv2
+from harris import harrisResponse, harrisCorners, suppressNonMaxima
+from descriptors import myLocalDescriptorBatch
+from keypoints import saveKeypoints, loadOrConvertKeypoints
 
 debug = False
 
@@ -14,23 +17,7 @@ def myLocalDescriptor(img, p, r_min, r_max, r_step, num_points):
     :param num_points: the number of points in the circle
     :return: descriptor that contains a value for each radius
     """
-    size = (r_max - r_min) // r_step
-    d = np.zeros((1, size))
-
-    if p[0] + r_max > img.shape[1] or p[1] + r_max > img.shape[0] or p[0] - r_max < 0 or p[1] - r_max < 0:
-        return d
-
-    index = 0
-    for radius in range(r_min, r_max, r_step):
-        x_rho = []
-        for theta in range(0, 360, 360 // num_points):
-            x = int(p[0] + radius * np.cos(theta))
-            y = int(p[1] + radius * np.sin(theta))
-            x_rho.append(img[y, x])
-
-        d[0, index] = np.mean(x_rho)
-        index += 1
-    return d
+    return myLocalDescriptorBatch(img, [p], r_min, r_max, r_step, num_points, fill=0)
 
 def myLocalDescriptorUpgrade(img, p, r_min, r_max, r_step, num_points):
     """
@@ -63,79 +50,87 @@ def myLocalDescriptorUpgrade(img, p, r_min, r_max, r_step, num_points):
 
     return d
 
-def filterClosePoints(coords, distance_threshold):
+def filterClosePoints(coords, distance_threshold, responses=None):
     """
-    Removes the points that are closer than the distance_threshold with each other
+    Removes the points that are closer than the distance_threshold with each other.
+    The points are put in a grid of distance_threshold sized cells, so each point is only compared
+    with the points of its 3x3 neighbouring cells.
     :param coords: the coordinates of the detected corners
     :param distance_threshold: the minimum distance between two points
+    :param responses: the Harris response of each point, if given the strongest point of each
+    neighbourhood is kept, otherwise a point is kept when no later point is close to it
     :return: a list that contains the filtered coordinates
     """
-    filtered_coordinates = []
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    cell_size = max(distance_threshold, 1)
+    cells = (coords // cell_size).tolist()
+    points = coords.tolist()
+    grid = {}
+    keep = []
+
+    if responses is None:
+        for i, cell in enumerate(cells):
+            grid.setdefault(tuple(cell), []).append(i)
+        order = range(len(points))
+    else:
+        order = np.argsort(-np.asarray(responses, dtype=np.float64), kind="stable").tolist()
 
-    for i, (x1, y1) in enumerate(coords):
+    for i in order:
+        (x1, y1), (cx, cy) = points[i], cells[i]
         is_close = False
 
-        for j, (x2, y2) in enumerate(coords[i + 1:], start=i + 1):
-            distance = ((x2 - x1) ** 2 + (y2 - y1) ** 2) ** 0.5
-
-            if distance < distance_threshold:
-                is_close = True
+        for neighbour in ((cx + dx, cy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+            for j in grid.get(neighbour, ()):
+                # Without responses every later point counts, with responses only the points already kept
+                if responses is None and j <= i:
+                    continue
+                x2, y2 = points[j]
+                if (x2 - x1) ** 2 + (y2 - y1) ** 2 < distance_threshold ** 2:
+                    is_close = True
+                    break
+            if is_close:
                 break
 
         if not is_close:
-            filtered_coordinates.append((x1, y1))
+            keep.append(i)
+            if responses is not None:
+                grid.setdefault((cx, cy), []).append(i)
 
+    filtered_coordinates = [tuple(points[i]) for i in sorted(keep)]
     return filtered_coordinates
 
-def myDetectHarrisFeatures(img, display_img):
+def myDetectHarrisFeatures(img, display_img, nms_radius=None, return_responses=False):
     """
     Detects all the corners in the given image using the derivatives of x-axis and y-axis.
     :param img: the given grayscale image
     :param display_img: the given image used for cv2.circle
+    :param nms_radius: if given, keep only the corners that are the maximum of the response in their
+    (2*nms_radius+1)^2 neighbourhood
+    :param return_responses: if True, also return the normalized response of each corner
     :return: the detected corners [x,y]
     """
     img_gaussian = cv2.bilateralFilter(img, 11, 80, 80)
     k = 0.04
     r_thresh = 0.2
     offset = 8
-    height = img.shape[0]
-    width = img.shape[1]
-    matrix_R = np.zeros((height, width))
-    cornerList = []
-
-    # Calculate the x and y image derivatives
-    dx = cv2.Sobel(img_gaussian, cv2.CV_64F, 1, 0, ksize=5)
-    dy = cv2.Sobel(img_gaussian, cv2.CV_64F, 0, 1, ksize=5)
-
-    # Calculate product and second derivatives
-    dx2 = np.square(dx)
-    dy2 = np.square(dy)
-    dxy = dx * dy
-
-    # Calculate derivatives per pixel
-    for y in range(offset, height - offset):
-        for x in range(offset, width - offset):
-            Sx2 = np.sum(dx2[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-            Sy2 = np.sum(dy2[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-            Sxy = np.sum(dxy[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-
-            H = np.array([[Sx2, Sxy], [Sxy, Sy2]])
-
-            # Calculate the response function ( R=det(H)-k(Trace(H))^2 )
-            R = np.linalg.det(H) - k * (np.matrix.trace(H) ** 2)
-            matrix_R[y - offset, x - offset] = R
-
-    # Normalize the R values in the range [0, 1]
+
+    # Calculate the response function for every pixel and normalize the R values in the range [0, 1]
+    matrix_R = harrisResponse(img_gaussian, k, offset)
     cv2.normalize(matrix_R, matrix_R, 0, 1, cv2.NORM_MINMAX)
 
-    for y in range(offset, height - offset):
-        for x in range(offset, width - offset):
-            if matrix_R[y, x] > r_thresh:
-                cornerList.append([x, y])
-                cv2.circle(display_img, (x, y), 1, (0, 255, 0), 1)
+    if nms_radius is None:
+        corners = harrisCorners(matrix_R, r_thresh, offset)
+    else:
+        corners = suppressNonMaxima(matrix_R, r_thresh, offset, nms_radius)
+
+    cornerList = corners.tolist()
+    for x, y in cornerList:
+        cv2.circle(display_img, (x, y), 1, (0, 255, 0), 1)
 
     cv2.imwrite("my_corners_img.jpg", display_img)
 
+    if return_responses:
+        return cornerList, matrix_R[corners[:, 1], corners[:, 0]]
     return cornerList
 
 # def descriptorMatching(p1, p2, threshold):
@@ -231,9 +226,9 @@ if __name__ == "__main__":
     grayscale1 = cv2.cvtColor(image1, cv2.COLOR_RGB2GRAY)
 
     if debug:
-        coordinates = myDetectHarrisFeatures(grayscale1, image1)
+        coordinates, responses = myDetectHarrisFeatures(grayscale1, image1, return_responses=True)
         print('coords', len(coordinates))
-        filtered_coordinates = filterClosePoints(coordinates, distance_threshold=5)
+        filtered_coordinates = filterClosePoints(coordinates, distance_threshold=5, responses=responses)
         img1 = {"corners": filtered_coordinates}
         print('filtered', len(filtered_coordinates))
 
@@ -242,14 +237,10 @@ if __name__ == "__main__":
         # cv2.imwrite("my_filt_corners_img.jpg", copyImg1)
         # breakpoint()
 
-        descriptor = np.zeros((len(img1["corners"]), 15))
-        for i, point in enumerate(img1["corners"]):
-            descriptor[i, :] = myLocalDescriptor(grayscale1, point, 5, 20, 1, 8)
-
-        img1["descriptor"] = descriptor
-        np.save('img1.npy', img1)
+        img1["descriptor"] = myLocalDescriptorBatch(grayscale1, img1["corners"], 5, 20, 1, 8, fill=0)
+        saveKeypoints('img1.kpd', img1["corners"], img1["descriptor"])
     else:
-        img1 = np.load('img1.npy', allow_pickle=True).item()
+        img1 = loadOrConvertKeypoints('img1.kpd', 'img1.npy')
         print(len(img1["corners"]))
 
     # Process the second image ######################
@@ -257,19 +248,14 @@ if __name__ == "__main__":
     grayscale2 = cv2.cvtColor(image2, cv2.COLOR_RGB2GRAY)
 
     if debug:
-        coordinates = myDetectHarrisFeatures(grayscale2, image2)
-        filtered_coordinates = filterClosePoints(coordinates, distance_threshold=5)
+        coordinates, responses = myDetectHarrisFeatures(grayscale2, image2, return_responses=True)
+        filtered_coordinates = filterClosePoints(coordinates, distance_threshold=5, responses=responses)
         img2 = {"corners": filtered_coordinates}
         print(len(img2["corners"]))
-        descriptor = np.zeros((len(img2["corners"]), 15))
-
-        for i, point in enumerate(img2["corners"]):
-            descriptor[i, :] = myLocalDescriptor(grayscale2, point, 5, 20, 1, 8)
-
-        img2["descriptor"] = descriptor
-        np.save('img2.npy', img2)
+        img2["descriptor"] = myLocalDescriptorBatch(grayscale2, img2["corners"], 5, 20, 1, 8, fill=0)
+        saveKeypoints('img2.kpd', img2["corners"], img2["descriptor"])
     else:
-        img2 = np.load('img2.npy', allow_pickle=True).item()
+        img2 = loadOrConvertKeypoints('img2.kpd', 'img2.npy')
         print(len(img2["corners"]))
 
     # points = np.array([100, 100], [200, 200], [202, 202])
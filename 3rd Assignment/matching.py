@@ -0,0 +1,169 @@
+import numpy as np
+from kdtree import buildKDTree, queryKDTree
+
+# Descriptors with a value above this limit are the sentinel rows of the points near the border
+sentinel_limit = 1000000
+sentinel_distance = 1e20
+
+def validDescriptors(descriptors):
+    """
+    Finds the descriptors that are not sentinel rows.
+    :param descriptors: an (N, D) array with the descriptors
+    :return: a boolean (N,) array that is True for the valid descriptors
+    """
+    return ~np.any(np.asarray(descriptors) > sentinel_limit, axis=1)
+
+def distanceBlocks(descriptors1, descriptors2, block_size=2048):
+    """
+    Computes the Euclidean distances between all the descriptors of the two images, block by block,
+    using ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab. The distances of the sentinel rows and columns are 1e20.
+    Only one block_size x block_size block is held in memory at a time.
+    :param descriptors1: an (N1, D) array with the descriptors of the first image
+    :param descriptors2: an (N2, D) array with the descriptors of the second image
+    :param block_size: the maximum number of rows and columns of each block
+    :return: a generator of (row_start, col_start, block) with the distances of each block
+    """
+    descriptors1 = np.asarray(descriptors1, dtype=np.float64)
+    descriptors2 = np.asarray(descriptors2, dtype=np.float64)
+    valid1 = validDescriptors(descriptors1)
+    valid2 = validDescriptors(descriptors2)
+
+    # Zero the sentinel rows, so they do not overflow the products, and mask them afterwards
+    descriptors1 = np.where(valid1[:, np.newaxis], descriptors1, 0)
+    descriptors2 = np.where(valid2[:, np.newaxis], descriptors2, 0)
+    norms1 = np.einsum("ij,ij->i", descriptors1, descriptors1)
+    norms2 = np.einsum("ij,ij->i", descriptors2, descriptors2)
+
+    for row_start in range(0, len(descriptors1), block_size):
+        rows = slice(row_start, row_start + block_size)
+
+        for col_start in range(0, len(descriptors2), block_size):
+            cols = slice(col_start, col_start + block_size)
+
+            block = descriptors1[rows] @ descriptors2[cols].T
+            block *= -2
+            block += norms1[rows, np.newaxis]
+            block += norms2[np.newaxis, cols]
+
+            # Rounding can make the squared distance of identical descriptors slightly negative
+            np.maximum(block, 0, out=block)
+            np.sqrt(block, out=block)
+
+            block[~valid1[rows], :] = sentinel_distance
+            block[:, ~valid2[cols]] = sentinel_distance
+
+            yield row_start, col_start, block
+
+def pairwiseDistances(descriptors1, descriptors2, block_size=2048):
+    """
+    Computes the full matrix of the Euclidean distances between the descriptors of the two images.
+    :param descriptors1: an (N1, D) array with the descriptors of the first image
+    :param descriptors2: an (N2, D) array with the descriptors of the second image
+    :param block_size: the maximum number of rows and columns computed at once
+    :return: the (N1, N2) distance matrix
+    """
+    distances = np.empty((len(descriptors1), len(descriptors2)))
+    for row_start, col_start, block in distanceBlocks(descriptors1, descriptors2, block_size):
+        distances[row_start:row_start + block.shape[0], col_start:col_start + block.shape[1]] = block
+
+    return distances
+
+def smallestColumns(block, k):
+    """
+    Finds the columns of the k smallest values of every row, without sorting the rows.
+    The lower column wins between equal values, unlike a plain np.argpartition.
+    :param block: an (N, M) array with M > k
+    :param k: the number of columns
+    :return: an (N, k) array with the columns of every row, in increasing order
+    """
+    kth = np.partition(block, k - 1, axis=1)[:, k - 1:k]
+    below = block < kth
+    tied = block == kth
+    # Only the first ties in column order fill the places that the smaller values leave
+    tied &= np.cumsum(tied, axis=1) <= k - np.count_nonzero(below, axis=1)[:, np.newaxis]
+
+    return np.nonzero(below | tied)[1].reshape(len(block), k)
+
+def nearestNeighbours(descriptors1, descriptors2, k=1, block_size=2048):
+    """
+    Finds the k nearest descriptors of the second image for every descriptor of the first image,
+    keeping a running top-k per row, so the full distance matrix is never stored.
+    The ties are resolved to the lower column, like np.argmin.
+    :param descriptors1: an (N1, D) array with the descriptors of the first image
+    :param descriptors2: an (N2, D) array with the descriptors of the second image
+    :param k: the number of neighbours to keep, 2 allows a ratio test
+    :param block_size: the maximum number of rows and columns of each distance block
+    :return: (N1, k) arrays with the indices and the distances of the neighbours, sorted by distance
+    """
+    best_indices = np.full((len(descriptors1), k), -1, dtype=np.int64)
+    best_distances = np.full((len(descriptors1), k), np.inf)
+
+    for row_start, col_start, block in distanceBlocks(descriptors1, descriptors2, block_size):
+        rows = slice(row_start, row_start + block.shape[0])
+
+        # Take the k smallest distances of the block, without sorting the whole block
+        if k == 1:
+            candidates = np.argmin(block, axis=1)[:, np.newaxis]
+        elif block.shape[1] > k:
+            candidates = smallestColumns(block, k)
+        else:
+            candidates = np.broadcast_to(np.arange(block.shape[1]), (block.shape[0], block.shape[1]))
+
+        # Merge them with the running top-k, the lower index wins between equal distances
+        indices = np.concatenate((best_indices[rows], candidates + col_start), axis=1)
+        distances = np.concatenate((best_distances[rows], np.take_along_axis(block, candidates, axis=1)), axis=1)
+        order = np.lexsort((indices, distances), axis=1)[:, :k]
+
+        best_indices[rows] = np.take_along_axis(indices, order, axis=1)
+        best_distances[rows] = np.take_along_axis(distances, order, axis=1)
+
+    return best_indices, best_distances
+
+def selectBestMatches(distances, thresh):
+    """
+    Selects the thresh fraction of the matches with the smallest distances, with a partial selection.
+    The matches tied with the last selected distance are kept in index order, so the result is the same
+    as the first matches of a stable sort by distance.
+    :param distances: an (N,) array with the distance of each match
+    :param thresh: the fraction of the matches to keep
+    :return: the indices of the selected matches, sorted by distance
+    """
+    distances = np.asarray(distances)
+    num_matches = min(int(thresh * len(distances)), len(distances))
+    if num_matches <= 0:
+        return np.array([], dtype=np.int64)
+
+    # The distance of the last selected match, every match below it is selected
+    cutoff = distances[np.argpartition(distances, num_matches - 1)[num_matches - 1]]
+    below = np.flatnonzero(distances < cutoff)
+    tied = np.flatnonzero(distances == cutoff)[:num_matches - len(below)]
+
+    selected = np.concatenate((below, tied))
+    return selected[np.argsort(distances[selected], kind="stable")]
+
+def buildDescriptorIndex(descriptors, leaf_size=16):
+    """
+    Builds a KD-tree over the valid descriptors of a reference image, to be reused for many query images.
+    :param descriptors: an (N, D) array with the descriptors of the reference image
+    :param leaf_size: the maximum number of descriptors in each leaf
+    :return: the tree, its ids are the rows of the descriptors
+    """
+    valid = validDescriptors(descriptors)
+    return buildKDTree(np.asarray(descriptors)[valid], ids=np.flatnonzero(valid), leaf_size=leaf_size)
+
+def indexedNeighbours(tree, descriptors, k=1, max_checks=None):
+    """
+    Finds the k nearest reference descriptors of every query descriptor with the KD-tree of the reference image.
+    The sentinel queries get the first reference descriptor at a distance of 1e20, like in nearestNeighbours.
+    :param tree: the tree of buildDescriptorIndex
+    :param descriptors: an (N, D) array with the query descriptors
+    :param k: the number of neighbours to keep
+    :param max_checks: the maximum number of leaves visited per query, None for an exact search
+    :return: (N, k) arrays with the indices and the distances of the neighbours, sorted by distance
+    """
+    valid = validDescriptors(descriptors)
+    indices = np.zeros((len(descriptors), k), dtype=np.int64)
+    distances = np.full((len(descriptors), k), sentinel_distance)
+    indices[valid], distances[valid] = queryKDTree(tree, np.asarray(descriptors)[valid], k, max_checks)
+
+    return indices, distances
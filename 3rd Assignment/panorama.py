@@ -0,0 +1,176 @@
+import sys
+from collections import OrderedDict
+import numpy as np
+import cv2
+from compositing import composite
+from featurestore import featureParams, cachedFeatures
+from transform import composeAffine, translationMatrix, rotationMatrix, warpRegion
+from updated_main import extractFeatures, descriptorMatching, myRansac
+
+def newMosaic(image):
+    """
+    Creates a mosaic that starts with the given image at the global position (0, 0)
+    :param image: the first frame
+    :return: the mosaic, a dictionary with the canvas, the canvas position of the global (0, 0)
+    and the global bounds [top, left, bottom, right] of the content
+    """
+    height, width = image.shape[:2]
+    return {"canvas": np.copy(image[:, :, :3]), "origin": [0, 0], "bounds": [0, 0, height, width]}
+
+def growCanvas(mosaic, top, left, bottom, right):
+    """
+    Makes sure the canvas covers the given global rectangle. The canvas grows by at least half its size
+    on each side that is too small, so the old content is copied only a few times over the whole sequence.
+    :param mosaic: the mosaic of newMosaic
+    :param top, left, bottom, right: the global rectangle
+    """
+    canvas = mosaic["canvas"]
+    height, width = canvas.shape[:2]
+    canvas_top, canvas_left = -mosaic["origin"][0], -mosaic["origin"][1]
+    canvas_bottom, canvas_right = canvas_top + height, canvas_left + width
+
+    if top >= canvas_top and left >= canvas_left and bottom <= canvas_bottom and right <= canvas_right:
+        return
+
+    grow_top = canvas_top - top if top < canvas_top else 0
+    grow_left = canvas_left - left if left < canvas_left else 0
+    grow_bottom = bottom - canvas_bottom if bottom > canvas_bottom else 0
+    grow_right = right - canvas_right if right > canvas_right else 0
+    grow_top, grow_bottom = [max(grow, height // 2) if grow else 0 for grow in (grow_top, grow_bottom)]
+    grow_left, grow_right = [max(grow, width // 2) if grow else 0 for grow in (grow_left, grow_right)]
+
+    grown = np.zeros((height + grow_top + grow_bottom, width + grow_left + grow_right, 3), dtype=canvas.dtype)
+    grown[grow_top:grow_top + height, grow_left:grow_left + width] = canvas
+    mosaic["canvas"] = grown
+    mosaic["origin"] = [mosaic["origin"][0] + grow_top, mosaic["origin"][1] + grow_left]
+
+def frameMatrix(image, d, theta):
+    """
+    Computes the transformation from the pixels of a frame to the pixels of the previous frame,
+    the same one my_stitch applies to its overlay.
+    :param image: the frame
+    :param d: the translation [dx, dy] of the rotated frame
+    :param theta: the angle of rotation, like in my_stitch
+    :return: the 2x3 matrix
+    """
+    height, width = image.shape[:2]
+    rotation, _ = rotationMatrix(image.shape, -theta, (width // 2, height // 2), anchor="grow")
+    return composeAffine(rotation, translationMatrix(d[0], d[1]))
+
+def placeFrame(mosaic, image, matrix, blend=None):
+    """
+    Warps the frame and composites it on the mosaic, touching only the region it covers.
+    :param mosaic: the mosaic of newMosaic
+    :param image: the frame
+    :param matrix: the 2x3 matrix from the pixels of the frame to the global (x, y) of the mosaic
+    :param blend: the blending mode of composite
+    """
+    # The global bounding box of the warped frame
+    height, width = image.shape[:2]
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]]) @ np.asarray(matrix).T
+    left, top = np.floor(corners.min(axis=0)).astype(int)
+    right, bottom = np.ceil(corners.max(axis=0)).astype(int)
+    growCanvas(mosaic, top, left, bottom, right)
+
+    transformed = warpRegion(image, matrix, (left, top, right - left, bottom - top))
+
+    origin = mosaic["origin"]
+    composite(mosaic["canvas"], transformed, (top + origin[0], left + origin[1]), blend)
+
+    bounds = mosaic["bounds"]
+    mosaic["bounds"] = [min(bounds[0], top), min(bounds[1], left), max(bounds[2], bottom), max(bounds[3], right)]
+
+def mosaicImage(mosaic):
+    """
+    Crops the canvas of the mosaic to its content
+    :param mosaic: the mosaic of newMosaic
+    :return: the panorama image
+    """
+    top, left, bottom, right = mosaic["bounds"]
+    origin = mosaic["origin"]
+    return mosaic["canvas"][top + origin[0]:bottom + origin[0], left + origin[1]:right + origin[1]]
+
+def stitchSequence(paths, r_min=5, r_max=20, r_step=1, num_per_circle=8, percentage_thresh=0.2, r=60, blend=None,
+                   cache_size=8, ransac_iterations=1000, seed=None, cache_dir=None, levels=1, verbose=False,
+                   return_stats=False):
+    """
+    Stitches a sequence of frames into one panorama. Every frame is registered against the previous one,
+    with the same matching and RANSAC as the two-image pipeline, and its transformation is composed with the
+    transformation of the previous frame, so the offsets of rotated frames are rotated into the mosaic.
+    The cost of each frame does not depend on the size of the mosaic.
+    :param paths: the file paths of the frames, in order
+    :param r_min, r_max, r_step, num_per_circle: the parameters for the local descriptor
+    :param percentage_thresh: the percentage of the matched points that are kept
+    :param r: the distance threshold of the RANSAC inliers
+    :param blend: the blending mode of composite
+    :param cache_size: the number of frames whose features are kept, for sequences that revisit frames
+    :param ransac_iterations: the maximum number of RANSAC hypotheses per frame
+    :param seed: the seed of RANSAC
+    :param cache_dir: the directory of the feature store that keeps the features between runs, None to not use it
+    :param levels: the number of pyramid levels of the corner detection, more levels help with frames
+    taken at different zooms
+    :param verbose: if True, print the transformation of every frame
+    :param return_stats: if True, also return a dictionary with the detection stats of extractFeatures for every
+    frame whose features were computed, the frames loaded from the feature store have none
+    :return: the panorama image
+    """
+    if len(paths) == 0:
+        raise ValueError("At least one frame is needed")
+
+    features_cache = OrderedDict()
+    feature_params = featureParams(r_min, r_max, r_step, num_per_circle, levels=levels)
+    stats = {}
+    mosaic = None
+    previous = None
+    matrix = np.eye(3)[:2]
+
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(path)
+
+        # Reuse the features of the frames that were already seen
+        if path in features_cache:
+            features_cache.move_to_end(path)
+        else:
+            grayscale = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            if cache_dir is None:
+                features_cache[path] = extractFeatures(grayscale, r_min, r_max, r_step, num_per_circle, levels=levels,
+                                                       return_stats=return_stats)
+            else:
+                features_cache[path] = cachedFeatures(image, feature_params, lambda: extractFeatures(
+                    grayscale, r_min, r_max, r_step, num_per_circle, levels=levels, return_stats=return_stats),
+                    cache_dir)
+            if "stats" in features_cache[path]:
+                stats[path] = features_cache[path]["stats"]
+            if len(features_cache) > cache_size:
+                features_cache.popitem(last=False)
+        features = features_cache[path]
+
+        if mosaic is None:
+            mosaic = newMosaic(image)
+        else:
+            previous_features, previous_width = previous
+            matchingPoints = descriptorMatching(previous_features, features, percentage_thresh)
+            d, theta, _, _ = myRansac(matchingPoints, previous_features, features, r, previous_width,
+                                      max_iterations=ransac_iterations, seed=seed)
+
+            # From the frame to the previous frame, then from the previous frame to the mosaic
+            matrix = composeAffine(frameMatrix(image, d, theta), matrix)
+            placeFrame(mosaic, image, matrix, blend)
+
+        previous = (features, image.shape[1])
+        if verbose:
+            print(path, "placed with", np.round(matrix, 3).tolist())
+
+    if return_stats:
+        return mosaicImage(mosaic), stats
+    return mosaicImage(mosaic)
+
+
+if __name__ == "__main__":
+    # The frames are given in order on the command line
+    frame_paths = sys.argv[1:] if len(sys.argv) > 1 else ["im1.png", "im2.png"]
+
+    panorama = stitchSequence(frame_paths)
+    cv2.imwrite("panorama.png", panorama)
@@ -1,14 +1,15 @@
 import numpy as np
 import cv2
+from keypoints import loadOrConvertKeypoints
 
 image1 = cv2.imread('im1.png')
 image2 = cv2.imread('im2.png')
 
 # Initiate SIFT detector
 # sift = cv2.SIFT_create()
-img1 = np.load('img1.npy', allow_pickle=True).item()
+img1 = loadOrConvertKeypoints('img1.kpd', 'img1.npy')
 keypoint1, descriptors1 = img1["corners"], img1["descriptor"]
-img2 = np.load('img2.npy', allow_pickle=True).item()
+img2 = loadOrConvertKeypoints('img2.kpd', 'img2.npy')
 keypoint2, descriptors2 = img2["corners"], img2["descriptor"]
 
 descriptors1 = np.array(descriptors1, dtype=np.float32)
@@ -16,11 +17,11 @@ descriptors2 = np.array(descriptors2, dtype=np.float32)
 keypoints1_updated = []
 keypoints2_updated = []
 
-for x, y in keypoint1:
+for x, y in keypoint1.tolist():
     keypoint = cv2.KeyPoint(x, y, 1)
     keypoints1_updated.append(keypoint)
 
-for x, y in keypoint2:
+for x, y in keypoint2.tolist():
     keypoint = cv2.KeyPoint(x, y, 1)
     keypoints2_updated.append(keypoint)
 
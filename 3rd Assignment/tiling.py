@@ -0,0 +1,126 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import cv2
+from harris import harrisCorners, tileResponse
+from descriptors import myLocalDescriptorBatch
+
+# The halo of the bilateral filter (d=11) and of the Sobel kernel (ksize=5)
+bilateral_halo = 5
+sobel_halo = 2
+
+def tileGrid(height, width, tile_size):
+    """
+    Splits a height x width area into tiles.
+    :param height, width: the size of the area
+    :param tile_size: the size of the tiles, the last tiles of each row and column are smaller
+    :return: a list with the (rows, cols) slices of the tiles
+    """
+    return [(slice(top, min(top + tile_size, height)), slice(left, min(left + tile_size, width)))
+            for top in range(0, height, tile_size) for left in range(0, width, tile_size)]
+
+def haloCrop(shape, rows, cols, halo):
+    """
+    Grows the tile by the halo on every side, without going outside the image.
+    :param shape: the shape of the image
+    :param rows, cols: the slices of the tile
+    :param halo: the number of pixels added on every side
+    :return: the (rows, cols) slices of the crop
+    """
+    return (slice(max(rows.start - halo, 0), min(rows.stop + halo, shape[0])),
+            slice(max(cols.start - halo, 0), min(cols.stop + halo, shape[1])))
+
+def responseTile(crop, rows, cols, k, offset):
+    """
+    Computes a block of the Harris response from a crop of the grayscale image.
+    :param crop: the crop of the grayscale image, with the halo of the block
+    :param rows, cols: the slices of the block, relative to the crop
+    :param k: the Harris detector free parameter
+    :param offset: half the size of the summation window
+    :return: the block of matrix_R, not normalized
+    """
+    img_gaussian = cv2.bilateralFilter(crop, 11, 80, 80)
+    return tileResponse(img_gaussian, k, offset, rows, cols)
+
+def descriptorTile(crop, points, r_min, r_max, r_step, num_points, fill):
+    """
+    Computes the descriptors of the corners of a tile from a crop of the grayscale image.
+    Every edge of the crop is either an edge of the image or at least r_max pixels away from the corners,
+    so the corners that are too close to the border are the same as on the whole image.
+    :param crop: the crop of the grayscale image, with a halo of r_max
+    :param points: an (N, 2) array with the corners [x, y], relative to the crop
+    :param r_min, r_max, r_step, num_points, fill: the parameters of myLocalDescriptorBatch
+    :return: the (N, n_radii) descriptors
+    """
+    return myLocalDescriptorBatch(crop, points, r_min, r_max, r_step, num_points, fill)
+
+def tiledFeatures(gray, r_min, r_max, r_step, num_per_circle, k=0.04, r_thresh=0.25, offset=4, tile_size=256,
+                  workers=None, executor="thread", return_stats=False):
+    """
+    Computes the same corners and descriptors as extractFeatures, with the Harris response and the descriptors
+    of every tile computed in parallel. Each tile gets a crop of the image with a halo wide enough for the
+    filters and the circles, and owns only its own pixels, so the merged results have no duplicates.
+    The response is normalized over the whole image after the merge, like in the single-tile path.
+    :param gray: the given grayscale image
+    :param r_min, r_max, r_step, num_per_circle: the parameters for the local descriptor
+    :param k, r_thresh, offset: the parameters for the Harris detector
+    :param tile_size: the size of the tiles
+    :param workers: the number of workers, by default the number of cores
+    :param executor: "thread" for a thread pool, that shares the image, or "process" for a process pool
+    :param return_stats: if True, also store the timing and corner count under "stats", like extractFeatures
+    :return: a dictionary with the corners and the descriptor for each corner
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor: {executor}")
+
+    workers = workers or os.cpu_count()
+    if executor == "thread":
+        pool = ThreadPoolExecutor(workers)
+    else:
+        # OpenCV has its own threads, one per process is enough when every core runs a worker
+        pool = ProcessPoolExecutor(workers, initializer=cv2.setNumThreads, initargs=(1,))
+
+    start = time.perf_counter()
+    height, width = gray.shape[:2]
+    matrix_R = np.zeros((height, width))
+    with pool:
+        # The response of the pixels of matrix_R that have a full window, the rest stays at zero
+        halo = sobel_halo + bilateral_halo
+        futures = []
+        for rows, cols in tileGrid(max(height - 2 * offset, 0), max(width - 2 * offset, 0), tile_size):
+            crop_rows, crop_cols = haloCrop(gray.shape, slice(rows.start, rows.stop + 2 * offset),
+                                            slice(cols.start, cols.stop + 2 * offset), halo)
+            block = (slice(rows.start - crop_rows.start, rows.stop - crop_rows.start),
+                     slice(cols.start - crop_cols.start, cols.stop - crop_cols.start))
+            futures.append((rows, cols, pool.submit(responseTile, gray[crop_rows, crop_cols], *block, k, offset)))
+        for rows, cols, future in futures:
+            matrix_R[rows, cols] = future.result()
+        num_tiles = len(futures)
+
+        cv2.normalize(matrix_R, matrix_R, 0, 1, cv2.NORM_MINMAX)
+        corners = harrisCorners(matrix_R, r_thresh, offset)
+
+        # Every corner belongs to the tile that contains it
+        descriptor = np.empty((len(corners), len(range(r_min, r_max, r_step))))
+        tiles_per_row = (width + tile_size - 1) // tile_size
+        owner = (corners[:, 1] // tile_size) * tiles_per_row + corners[:, 0] // tile_size
+        order = np.argsort(owner, kind="stable")
+        tiles, starts = np.unique(owner[order], return_index=True)
+        futures = []
+        for tile, indices in zip(tiles.tolist(), np.split(order, starts[1:])):
+            tile_y, tile_x = divmod(tile, tiles_per_row)
+            rows = slice(tile_y * tile_size, (tile_y + 1) * tile_size)
+            cols = slice(tile_x * tile_size, (tile_x + 1) * tile_size)
+            crop_rows, crop_cols = haloCrop(gray.shape, rows, cols, r_max)
+            points = corners[indices] - [crop_cols.start, crop_rows.start]
+            futures.append((indices, pool.submit(descriptorTile, gray[crop_rows, crop_cols], points,
+                                                 r_min, r_max, r_step, num_per_circle, 1e20)))
+        for indices, future in futures:
+            descriptor[indices] = future.result()
+
+    features = {"corners": corners.tolist(), "descriptor": descriptor}
+    if return_stats:
+        features["stats"] = [{"level": 0, "shape": gray.shape[:2], "detected": len(corners), "corners": len(corners),
+                              "tiles": num_tiles, "seconds": time.perf_counter() - start}]
+    return features
@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+
+# Every assignment folder runs on its own, so the 2nd and the 3rd Assignment have the same copy of this module
+
+def composeAffine(*matrices):
+    """
+    Composes 2x3 affine matrices into one, so the image is warped only once.
+    :param matrices: the matrices, in the order they are applied to the points
+    :return: the 2x3 matrix of the composed transformation
+    """
+    composed = np.eye(3)
+    for matrix in matrices:
+        composed = np.vstack((np.asarray(matrix, dtype=np.float64), [0, 0, 1])) @ composed
+
+    return composed[:2]
+
+def translationMatrix(dx, dy):
+    """
+    :param dx, dy: the translation
+    :return: the 2x3 matrix of the translation
+    """
+    return np.array([[1.0, 0.0, dx], [0.0, 1.0, dy]])
+
+def rotationMatrix(shape, angle, center=None, anchor="center"):
+    """
+    Computes the matrix that rotates the image about the center and the size of the canvas that holds
+    the whole rotated image.
+    :param shape: the shape of the image
+    :param angle: the angle of rotation in degrees, counterclockwise
+    :param center: the (x, y) center of rotation, by default the middle of the image (width / 2, height / 2)
+    :param anchor: where the center goes on the canvas, "center" for the middle of the canvas,
+    or "grow" to move it by half the growth of the canvas
+    :return: the 2x3 matrix and the (width, height) of the canvas
+    """
+    if anchor not in ("center", "grow"):
+        raise ValueError(f"Unknown anchor: {anchor}")
+
+    height, width = shape[:2]
+    if center is None:
+        center = (width / 2, height / 2)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+
+    # Calculate the new bounding dimensions of the rotated image
+    abs_cos = abs(matrix[0, 0])
+    abs_sin = abs(matrix[0, 1])
+    new_width = int(height * abs_sin + width * abs_cos)
+    new_height = int(height * abs_cos + width * abs_sin)
+
+    # Adjust the rotation matrix to take into account translation
+    if anchor == "center":
+        matrix[0, 2] += new_width / 2 - center[0]
+        matrix[1, 2] += new_height / 2 - center[1]
+    else:
+        matrix[0, 2] += (new_width - width) / 2
+        matrix[1, 2] += (new_height - height) / 2
+
+    return matrix, (new_width, new_height)
+
+def warpRegion(image, matrix, region, border_value=0, dst=None):
+    """
+    Warps only a region of the output of cv2.warpAffine, without computing the rest of the output.
+    A region that does not start at (0, 0) can differ from the crop of the whole output by 1 gray level
+    in a few pixels, because of the fixed point arithmetic of OpenCV.
+    :param image: the given image
+    :param matrix: the 2x3 matrix from the image to the whole output
+    :param region: the (x, y, width, height) of the region of the output
+    :param border_value: the value of the pixels that fall outside the image
+    :param dst: an array to write the region into, e.g. a view of a reused buffer
+    :return: the warped region
+    """
+    x, y, width, height = region
+    if x or y:
+        matrix = composeAffine(matrix, translationMatrix(-x, -y))
+
+    return cv2.warpAffine(image, matrix, (width, height), dst=dst, borderValue=border_value)
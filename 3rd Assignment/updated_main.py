@@ -1,39 +1,43 @@
+import time
 import numpy as np
 import cv2
+from harris import harrisResponse, harrisCorners, pyramidHarris
+from descriptors import myLocalDescriptorBatch
+from compositing import composite
+from transform import rotationMatrix, warpRegion
+from tiling import tiledFeatures
+from featurestore import featureParams, cachedFeatures
+from matching import pairwiseDistances, nearestNeighbours, selectBestMatches, indexedNeighbours
 from sklearn.cluster import KMeans
-import random
 
-# Make sure to set this to True when you want to run all the functions and detect the corners
-debug = False
-
-def myLocalDescriptor(img, p, r_min, r_max, r_step, num_points):
+def detectHarrisCorners(gray_img, k=0.04, r_thresh=0.25, offset=4, levels=1, return_stats=False):
     """
-    Computes the local descriptor for each pixel in the image, using circles of different radius.
-    :param img: the given image
-    :param p: the given pixel
-    :param r_min: the minimum radius
-    :param r_max: the maximum radius
-    :param r_step: the step of the radius
-    :param num_points: the number of points in each circle
-    :return: descriptor that contains a value for each radius
+    Detects all the corners in the given image, without drawing them.
+    :param gray_img: the given grayscale image
+    :param k: the Harris detector free parameter
+    :param r_thresh: the threshold for the normalized response
+    :param offset: half the size of the summation window
+    :param levels: the number of pyramid levels, with more than 1 the corners are detected on the coarsest level
+    and refined on the finer ones
+    :param return_stats: if True, also return the timings and corner counts of every level, like pyramidHarris
+    :return: an (N, 2) array with the detected corners [x,y]
     """
-    size = (r_max - r_min) // r_step
-    d = np.full((1, size), 1e20)
-
-    if p[0] + r_max > img.shape[1] or p[1] + r_max > img.shape[0] or p[0] - r_max < 0 or p[1] - r_max < 0:
-        return d
-
-    index = 0
-    for radius in range(r_min, r_max, r_step):
-        x_rho = []
-        for theta in range(0, 360, 360 // num_points):
-            x = int(p[0] + radius * np.cos(theta))
-            y = int(p[1] + radius * np.sin(theta))
-            x_rho.append(img[y, x])
-
-        d[0, index] = np.mean(x_rho)
-        index += 1
-    return d
+    start = time.perf_counter()
+    img_gaussian = cv2.bilateralFilter(gray_img, 11, 80, 80)
+
+    if levels > 1:
+        corners, stats = pyramidHarris(img_gaussian, k, r_thresh, offset, levels)
+        return (corners, stats) if return_stats else corners
+
+    # Calculate the response function for every pixel and normalize the R values in the range [0, 1]
+    matrix_R = harrisResponse(img_gaussian, k, offset)
+    cv2.normalize(matrix_R, matrix_R, 0, 1, cv2.NORM_MINMAX)
+
+    corners = harrisCorners(matrix_R, r_thresh, offset)
+    if return_stats:
+        return corners, [{"level": 0, "shape": gray_img.shape[:2], "detected": len(corners), "corners": len(corners),
+                          "tiles": 0, "seconds": time.perf_counter() - start}]
+    return corners
 def myDetectHarrisFeatures(display_img, gray_img):
     """
     Detects all the corners in the given image using the derivatives of x-axis and y-axis.
@@ -41,45 +45,9 @@ def myDetectHarrisFeatures(display_img, gray_img):
     :param display_img: the given image used for cv2.circle
     :return: the detected corners [x,y]
     """
-    img_gaussian = cv2.bilateralFilter(gray_img, 11, 80, 80)
-    k = 0.04
-    r_thresh = 0.25
-    offset = 4
-    height = gray_img.shape[0]
-    width = gray_img.shape[1]
-    matrix_R = np.zeros((height, width))
-    cornerList = []
-
-    # Calculate the x and y image derivatives
-    dx = cv2.Sobel(img_gaussian, cv2.CV_64F, 1, 0, ksize=5)
-    dy = cv2.Sobel(img_gaussian, cv2.CV_64F, 0, 1, ksize=5)
-
-    # Calculate product and second derivatives
-    dx2 = np.square(dx)
-    dy2 = np.square(dy)
-    dxy = dx * dy
-
-    # Calculate derivatives per pixel
-    for y in range(offset, height - offset):
-        for x in range(offset, width - offset):
-            Sx2 = np.sum(dx2[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-            Sy2 = np.sum(dy2[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-            Sxy = np.sum(dxy[y - offset:y + 1 + offset, x - offset:x + 1 + offset])
-
-            H = np.array([[Sx2, Sxy], [Sxy, Sy2]])
-
-            # Calculate the response function ( R=det(H)-k(Trace(H))^2 )
-            R = np.linalg.det(H) - k * (np.matrix.trace(H) ** 2)
-            matrix_R[y - offset, x - offset] = R
-
-    # Normalize the R values in the range [0, 1]
-    cv2.normalize(matrix_R, matrix_R, 0, 1, cv2.NORM_MINMAX)
-
-    for y in range(offset, height - offset):
-        for x in range(offset, width - offset):
-            if matrix_R[y, x] > r_thresh:
-                cornerList.append([x, y])
-                cv2.circle(display_img, (x, y), 1, (0, 255, 0), 1)
+    cornerList = detectHarrisCorners(gray_img).tolist()
+    for x, y in cornerList:
+        cv2.circle(display_img, (x, y), 1, (0, 255, 0), 1)
 
     cv2.imwrite("my_corners_img.jpg", display_img)
 
@@ -95,56 +63,70 @@ def preProcessCorners(img, gray, r_min, r_max, r_step, num_per_circle, matrix_si
     coordinates = myDetectHarrisFeatures(img, gray)
     print('coords', len(coordinates))
 
-    descriptor = np.zeros((len(coordinates), matrix_size))
-    for i, point in enumerate(coordinates):
-        descriptor[i, :] = myLocalDescriptor(gray, point, r_min, r_max, r_step, num_per_circle)
+    descriptor = myLocalDescriptorBatch(gray, coordinates, r_min, r_max, r_step, num_per_circle)
 
     return coordinates, descriptor
+def extractFeatures(gray, r_min, r_max, r_step, num_per_circle, k=0.04, r_thresh=0.25, offset=4, levels=1,
+                    workers=None, return_stats=False):
+    """
+    Detects the corners of the image and computes their descriptors, without drawing or saving anything.
+    :param gray: the given grayscale image
+    :param r_min, r_max, r_step, num_per_circle: the parameters for the local descriptor
+    :param k, r_thresh, offset, levels: the parameters for the Harris detector
+    :param workers: if given, split the image in tiles and process them on this many threads,
+    only for the full resolution detection
+    :param return_stats: if True, also store the timings and corner counts of every level under "stats"
+    :return: a dictionary with the corners and the descriptor for each corner
+    """
+    if workers is not None:
+        if levels > 1:
+            raise ValueError("The tiled extraction only supports levels=1")
+        return tiledFeatures(gray, r_min, r_max, r_step, num_per_circle, k, r_thresh, offset, workers=workers,
+                             return_stats=return_stats)
+
+    coordinates, stats = detectHarrisCorners(gray, k, r_thresh, offset, levels, return_stats=True)
+    descriptor = myLocalDescriptorBatch(gray, coordinates, r_min, r_max, r_step, num_per_circle)
+
+    features = {"corners": coordinates.tolist(), "descriptor": descriptor}
+    if return_stats:
+        features["stats"] = stats
+    return features
 def calculateDistances(corners1, corners2, descriptors1, descriptors2):
     """
-    Calculates the Euclidean distances as the absolute value of the difference between the two points.
+    Calculates the Euclidean distances between the descriptors of the corners of the two images.
+    The descriptors of the corners near the border are sentinel rows and get a distance of 1e20.
     :param corners1: the detected corners from the first image
     :param corners2: the detected corners from the second image
     :return: the Euclidean distances
     """
-    distances = np.zeros((len(corners1), len(corners2)))
-    for index1, corner1 in enumerate(corners1):
-        descriptor1 = np.array(descriptors1[index1])
-        if np.any(descriptor1 > 1000000):
-            distances[index1, :] = 1e20
-            continue
-        for index2, corner2 in enumerate(corners2):
-            descriptor2 = np.array(descriptors2[index2])
-            if np.any(descriptor2 > 1000000):
-                distances[index1, index2] = 1e20
-            else:
-                distances[index1, index2] = np.abs(np.linalg.norm(descriptor1 - descriptor2))
-
-    np.save("distances.npy", distances)
-def descriptorMatching(p1, p2, thresh):
+    return pairwiseDistances(descriptors1, descriptors2)
+def descriptorMatching(p1, p2, thresh, ratio=None, index=None, max_checks=None):
     """
     Matches the descriptors of two points of the two images and returns the 30% of the matched points
     :param p1: the dictionary of first image
     :param p2: the dictionary of second image
     :param thresh: the percentage of the matched points we want to return
+    :param ratio: if given, keep only the matches that are closer than ratio times the second best match
+    :param index: the KD-tree of the second image from buildDescriptorIndex, None for a brute-force search
+    :param max_checks: the maximum number of leaves the KD-tree visits per corner, None for an exact search
     :return: a list that contains the matched points
     """
-    corners1, descriptors1 = p1["corners"], p1["descriptor"]
-    if debug:
-        corners2, descriptors2 = p2["corners"], p2["descriptor"]
-        calculateDistances(corners1, corners2, descriptors1, descriptors2)
-
-    distances = np.load("distances.npy")
-    matched_points = []
-
-    for index, corner in enumerate(corners1):
-        corner_distances = distances[index]
-        min_value = min(corner_distances)
-        min_index = np.argmin(corner_distances)
-        matched_points.append((index, min_index, min_value))
-
-    min_indices = sorted(matched_points, key=lambda x: x[2])
-    min_indices = min_indices[:int(thresh * len(matched_points))]
+    descriptors1, descriptors2 = p1["descriptor"], p2["descriptor"]
+
+    # Find the nearest descriptor of the second image for each corner of the first image
+    k = 1 if ratio is None else 2
+    if index is None:
+        neighbours, distances = nearestNeighbours(descriptors1, descriptors2, k)
+    else:
+        neighbours, distances = indexedNeighbours(index, descriptors1, k, max_checks)
+
+    candidates = np.arange(len(descriptors1))
+    if ratio is not None:
+        candidates = candidates[distances[:, 0] < ratio * distances[:, 1]]
+
+    # Keep the best matches
+    best = candidates[selectBestMatches(distances[candidates, 0], thresh)]
+    min_indices = list(zip(best.tolist(), neighbours[best, 0], distances[best, 0]))
     return min_indices
 def calculate_theta(x1, y1, x2, y2):
     delta_x = x2 - x1
@@ -155,71 +137,109 @@ def calculate_theta(x1, y1, x2, y2):
     return theta
 def getTransformedPoints(matched_points, points2, d, theta):
     """
-    Gets the matched points and calculates the transformed points
+    Gets the matched points and calculates the transformed points of one or more hypotheses at once
+    :param matched_points: the matched points, (index1, index2, distance)
+    :param points2: the corners of the second image
+    :param d: the translation [dx, dy], or an (H, 2) array with one translation per hypothesis
+    :param theta: the angle of rotation, or an (H,) array with one angle per hypothesis
+    :return: an (M, 2) array with the transformed points, or an (H, M, 2) array for many hypotheses
     """
-    transformed_points = []
-    cos_sin_matrix = np.array([[np.cos(theta), -np.sin(theta)],
-                               [np.sin(theta), np.cos(theta)]])
-
-    for index, match in enumerate(matched_points):
-        x_old, y_old = points2[match[1]]
-        point2 = np.array([x_old, y_old])
-
-        transformed_point = np.dot(cos_sin_matrix.T, point2)
-        transformed_point = transformed_point + d
-        transformed_points.append(transformed_point)
-
-    return transformed_points
-def myRansac(matched_points, img1, img2, r_thresh, image1_width):
+    indices2 = np.array([match[1] for match in matched_points], dtype=np.int64)
+    point2 = np.asarray(points2)[indices2].astype(np.float64)
+    d = np.asarray(d, dtype=np.float64)
+    theta = np.asarray(theta, dtype=np.float64)
+    cos_theta = np.cos(theta)[..., np.newaxis]
+    sin_theta = np.sin(theta)[..., np.newaxis]
+
+    # Rotate by the transpose of [[cos, -sin], [sin, cos]] and translate by d
+    transformed_x = cos_theta * point2[:, 0] + sin_theta * point2[:, 1] + d[..., 0:1]
+    transformed_y = -sin_theta * point2[:, 0] + cos_theta * point2[:, 1] + d[..., 1:2]
+
+    return np.stack((transformed_x, transformed_y), axis=-1)
+def myRansac(matched_points, img1, img2, r_thresh, image1_width, confidence=None, max_iterations=None, seed=None,
+             batch_size=64):
     """
-    Gets the matched points and compares random pairs to find the optimal transformation matrix
+    Gets the matched points and compares random pairs to find the optimal transformation matrix.
+    Every hypothesis pairs a match with a randomly chosen one, and batch_size hypotheses are scored
+    against all the matches at once.
+    :param confidence: if given, stop once the probability of having drawn an all-inlier pair reaches it,
+    according to the best inlier ratio so far
+    :param max_iterations: the maximum number of hypotheses, by default one per match
+    :param seed: the seed of the random generator
+    :param batch_size: the number of hypotheses scored at once
     :return: best_d, best_theta, best_inliers, best_outliers
     """
-    best_inliers = []
-    best_outliers = []
-    points1 = img1['corners']
-    points2 = img2['corners']
-    best_score = 0
-    shuffled_points = np.copy(matched_points)
-    random.shuffle(shuffled_points)
-
-    for index, match in enumerate(matched_points):
-        inliers = []
-        outliers = []
-
-        im1_x1, im1_y1 = points1[matched_points[index][0]]
-        im2_x1, im2_y1 = points1[int(shuffled_points[index][1])]
-        im2_x1 = im2_x1 + image1_width
-        theta = calculate_theta(im1_x1, im1_y1, im2_x1, im2_y1)
-        theta = -theta
-
-        magnitude, angle = cv2.cartToPolar((im1_x1, im2_x1), (im1_y1, im2_y1), angleInDegrees=0)
-        magnitude = int(magnitude[0])
-        magnitudem = [magnitude, 0]
-
-        transformed_points = getTransformedPoints(matched_points, points2, magnitudem, theta)
-        for index, point in enumerate(transformed_points):
-            x_1, y_1 = points1[matched_points[index][0]]
-            x_new, y_new = point
-            distance = np.linalg.norm(np.array([x_1, y_1]) - np.array([x_new, y_new]))
-
-            if distance < r_thresh:
-                inliers.append(matched_points[index])
-            else:
-                outliers.append(matched_points[index])
-
-        score = len(inliers) / len(matched_points)
-
-        if score > best_score:
-            best_score = score
-            best_d = magnitudem
-            best_theta = theta
-            best_inliers = []
-            best_outliers = []
-            best_inliers.append(inliers)
-            best_outliers.append(outliers)
+    rng = np.random.default_rng(seed)
+    num_matches = len(matched_points)
+    best_d, best_theta, best_score = [0, 0], 0, 0
+    best_inliers, best_outliers = [[]], [list(matched_points)]
+    if num_matches == 0:
+        return best_d, best_theta, best_inliers, best_outliers
+
+    points1 = np.asarray(img1['corners'])
+    points2 = np.asarray(img2['corners'])
+    indices1 = np.array([match[0] for match in matched_points], dtype=np.int64)
+    indices2 = np.array([match[1] for match in matched_points], dtype=np.int64)
+    match_points1 = points1[indices1].astype(np.float64)
+    max_iterations = num_matches if max_iterations is None else max_iterations
+    iterations = max_iterations
+    tested = 0
+
+    while tested < min(iterations, max_iterations):
+        # Each pass tries every match once, paired with a shuffled match
+        first = np.arange(num_matches)
+        second = rng.permutation(num_matches)
+
+        for batch_start in range(0, num_matches, batch_size):
+            remaining = min(iterations, max_iterations) - tested
+            if remaining <= 0:
+                break
+            batch = slice(batch_start, batch_start + min(batch_size, remaining))
+
+            im1_x1, im1_y1 = match_points1[first[batch], 0], match_points1[first[batch], 1]
+            im2_x1, im2_y1 = points2[indices2[second[batch]]].T.astype(np.float64)
+            im2_x1 = im2_x1 + image1_width
+            theta = -calculate_theta(im1_x1, im1_y1, im2_x1, im2_y1)
+
+            magnitude = np.hypot(im1_x1, im1_y1).astype(np.int64)
+            d = np.column_stack((magnitude, np.zeros_like(magnitude)))
+
+            # Score all the hypotheses of the batch against all the matches
+            transformed_points = getTransformedPoints(matched_points, img2['corners'], d, theta)
+            distances = np.linalg.norm(transformed_points - match_points1, axis=2)
+            is_inlier = distances < r_thresh
+            scores = is_inlier.sum(axis=1) / num_matches
+            tested += len(theta)
+
+            best = int(np.argmax(scores))
+            if scores[best] > best_score:
+                best_score = scores[best]
+                best_d = [int(magnitude[best]), 0]
+                best_theta = theta[best]
+                best_inliers = [[match for match, inlier in zip(matched_points, is_inlier[best]) if inlier]]
+                best_outliers = [[match for match, inlier in zip(matched_points, is_inlier[best]) if not inlier]]
+
+                # Update the number of hypotheses needed for the requested confidence
+                if confidence is not None:
+                    iterations = ransacIterations(best_score, confidence, max_iterations)
 
     return best_d, best_theta, best_inliers, best_outliers
+def ransacIterations(inlier_ratio, confidence, max_iterations, sample_size=2):
+    """
+    Calculates how many hypotheses are needed to draw an all-inlier sample with the given confidence
+    :param inlier_ratio: the fraction of inliers of the best hypothesis
+    :param confidence: the probability of drawing at least one all-inlier sample
+    :param max_iterations: the upper limit of the hypotheses
+    :param sample_size: the number of matches of each hypothesis
+    :return: the number of hypotheses
+    """
+    all_inliers = inlier_ratio ** sample_size
+    if all_inliers >= 1:
+        return 1
+    if all_inliers <= 0:
+        return max_iterations
+
+    return min(max_iterations, int(np.ceil(np.log(1 - confidence) / np.log(1 - all_inliers))))
 def rotate_image(image, angle):
     """
     Rotates an image about its center by the given angle
@@ -228,55 +248,41 @@ def rotate_image(image, angle):
     :return: The rotated image
     """
     height, width = image.shape[:2]
-    center = (width // 2, height // 2)
-
-    # Compute the rotation matrix
-    rotation_matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
 
-    # Calculate the new bounding dimensions of the rotated image
-    abs_cos = abs(rotation_matrix[0, 0])
-    abs_sin = abs(rotation_matrix[0, 1])
-    new_width = int(height * abs_sin + width * abs_cos)
-    new_height = int(height * abs_cos + width * abs_sin)
-
-    # Adjust the rotation matrix to take into account translation
-    rotation_matrix[0, 2] += (new_width - width) / 2
-    rotation_matrix[1, 2] += (new_height - height) / 2
+    # Compute the rotation matrix, the image center moves by half the growth of the canvas
+    rotation_matrix, new_size = rotationMatrix(image.shape, angle, (width // 2, height // 2), anchor="grow")
 
     # Perform the actual rotation and return the rotated image
-    rotated_image = cv2.warpAffine(image, rotation_matrix, (new_width, new_height))
+    rotated_image = cv2.warpAffine(image, rotation_matrix, new_size)
 
     return rotated_image
 
-def my_stitch(im1, im2, d, theta):
+def my_stitch(im1, im2, d, theta, blend=None):
     """
     Overlays two images
     :param im1: The background image
     :param im2: The overlay image
     :param theta: The angle of rotation in radians
+    :param blend: None to copy the overlay, "feather" or "linear" to blend the seam of the two images
     :return: The stitched image
     """
     dx, dy = d
-    transformed_im2 = rotate_image(im2, -theta)
-
-    stitched_width = max(im1.shape[1], transformed_im2.shape[1] + abs(dx))
-    stitched_height = max(im1.shape[0], transformed_im2.shape[0] + abs(dy))
+    height, width = im2.shape[:2]
+    rotation_matrix, (new_width, new_height) = rotationMatrix(im2.shape, -theta, (width // 2, height // 2),
+                                                              anchor="grow")
 
-    im2_origin = (dy, dx)
-
-    translated_im2 = np.zeros((stitched_height, stitched_width, 3), dtype=np.uint8)
-    for i in range(transformed_im2.shape[0]):
-        for j in range(transformed_im2.shape[1]):
-            if transformed_im2[i, j].any() != 0:
-                translated_im2[i + im2_origin[0], j + im2_origin[1]] = transformed_im2[i, j, :3]
+    stitched_width = max(im1.shape[1], new_width + abs(dx))
+    stitched_height = max(im1.shape[0], new_height + abs(dy))
 
     stitched = np.zeros((stitched_height, stitched_width, 3), dtype=np.uint8)
     stitched[:im1.shape[0], :im1.shape[1]] = im1
 
-    for i in range(translated_im2.shape[0]):
-        for j in range(translated_im2.shape[1]):
-            if translated_im2[i, j].any() != 0:
-                stitched[i, j] = translated_im2[i, j, :3]
+    # Warp only the part of the rotated overlay that falls inside the stitched image
+    left, top = max(-dx, 0), max(-dy, 0)
+    right, bottom = min(new_width, stitched_width - dx), min(new_height, stitched_height - dy)
+    if left < right and top < bottom:
+        transformed_im2 = warpRegion(im2, rotation_matrix, (left, top, right - left, bottom - top))
+        composite(stitched, transformed_im2, (dy + top, dx + left), blend)
 
     return stitched
 
@@ -289,30 +295,26 @@ if __name__ == "__main__":
     num_per_circle = 8
     matrix_size = (r_max - r_min) // r_step
 
+    # Parameters for the Harris detector
+    k = 0.04
+    r_thresh = 0.25
+    offset = 4
+    feature_params = featureParams(r_min, r_max, r_step, num_per_circle, k, r_thresh, offset)
+
     # Parameter for the descriptorMatching
     percentage_thresh = 0.2
 
-    # Load and Detect the corners on the first image
+    # Load and Detect the corners on the first image, unless they are in the feature store
     image1 = cv2.imread("im1.png")
     grayscale1 = cv2.cvtColor(image1, cv2.COLOR_RGB2GRAY)
+    img1 = cachedFeatures(image1, feature_params,
+                          lambda: extractFeatures(grayscale1, r_min, r_max, r_step, num_per_circle, k, r_thresh, offset))
 
-    if debug:
-        filtered_corner_coords, descriptors = preProcessCorners(image1, grayscale1, r_min, r_max, r_step, num_per_circle, matrix_size)
-        img1 = {"corners": filtered_corner_coords, "descriptor": descriptors}
-        np.save('img1.npy', img1)
-    else:
-        img1 = np.load('img1.npy', allow_pickle=True).item()
-
-    # Load and Detect the corners on the second image
+    # Load and Detect the corners on the second image, unless they are in the feature store
     image2 = cv2.imread("im2.png")
     grayscale2 = cv2.cvtColor(image2, cv2.COLOR_RGB2GRAY)
-
-    if debug:
-        filtered_corner_coords, descriptors = preProcessCorners(image2, grayscale2, r_min, r_max, r_step, num_per_circle, matrix_size)
-        img2 = {"corners": filtered_corner_coords, "descriptor": descriptors}
-        np.save('img2.npy', img2)
-    else:
-        img2 = np.load('img2.npy', allow_pickle=True).item()
+    img2 = cachedFeatures(image2, feature_params,
+                          lambda: extractFeatures(grayscale2, r_min, r_max, r_step, num_per_circle, k, r_thresh, offset))
 
     # Match the descriptors
     r = 60